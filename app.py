@@ -1,203 +1,45 @@
 import streamlit as st
 import pandas as pd
-import sys
 import time
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from pinecone_model import searcher as pine_searcher
-import json
-from langchain_groq import ChatGroq
-from db import db_setup, queries
-import pandas.io.sql as psql
-import psycopg2
-from typing import Tuple, Dict, List
 import os
+from concurrent.futures import ThreadPoolExecutor
+import rag
+import retrieval
 
 st.set_page_config(layout="wide") 
 
-llm = ChatGroq(model="llama3-70b-8192", api_key=os.environ.get('LLAMA_KEY'))
 
-def connect_to_db(host: str, name: str, user: str, password: str) -> Tuple[psycopg2.extensions.connection, psycopg2.extensions.cursor]:
+@st.cache_resource
+def get_backend():
 	"""
-	Connects to a PostgreSQL database.
-
-	Args:
-		host (str): The database host.
-		name (str): The database name.
-		user (str): The username for authentication.
-		password (str): The password for authentication.
+	Returns the retrieval backend shared by every session: a client for the search
+	service when SEARCH_SERVICE_URL is set, otherwise an in-process pipeline.
 
 	Returns:
-		Tuple[psycopg2.extensions.connection, psycopg2.extensions.cursor]: A connection object and a cursor object.
+		retrieval.SearchClient or retrieval.SearchPipeline: The retrieval backend.
 	"""
-	
-	conn = psycopg2.connect(f"host={host} dbname={name} user={user} password={password}")
-	curr = conn.cursor()
 
-	return conn, curr
+	url = os.environ.get('SEARCH_SERVICE_URL')
+	if url:
+		return retrieval.SearchClient(url)
 
-def parse_pine(results: Dict) -> List[str]:
-	"""
-	Parses Pinecone search results to extract IDs and metadata.
+	return retrieval.SearchPipeline("beta-index")
 
-	Args:
-		results (Dict): The results returned from a Pinecone query.
 
-	Returns:
-		List[str]: A list of extracted IDs from the results.
+def show_results(slot, enriched_df: pd.DataFrame) -> None:
 	"""
-	
-	table_data = []
-	ids = []
-
-	for i, result in enumerate(results['matches'], start=1):
-		ids.append(result['id'])
-		result_data = {
-			"ID": result['id'],
-			"metadata": result['metadata']["Categories"],
-			"score": result['score']
-		}
-		table_data.append(result_data)		
-
-	return ids
-
-
-def convert_to_df(ids: List[str], data: pd.DataFrame) -> pd.DataFrame:
-	"""
-	Converts Pinecone IDs to a DataFrame with corresponding offers and categories.
+	Renders the retrieved offers with their retailers and brands.
 
 	Args:
-		ids (List[str]): The list of IDs to convert.
-		data (pd.DataFrame): The dataset to match IDs with offers and categories.
-
-	Returns:
-		pd.DataFrame: A DataFrame containing IDs, offers, and categories.
+		slot: The Streamlit placeholder to render into.
+		enriched_df (pd.DataFrame): The enriched offer rows, in result order.
 	"""
-	categories = []
-	offers = []
-	for id in ids:
-		offers.append(data[data["UNIQUE_ID"] == id]["OFFER"].values[0])
-		categories.append(data[data["UNIQUE_ID"] == id]["CATEGORY"].values[0])
-
-	df = pd.DataFrame({'ids': ids, 'offers': offers, "categories": categories})
 
-	return df
-
-
-def execute_search(query: str, k: int) -> Tuple[float, Dict]:
-	"""
-	Executes a search query using the Pinecone model.
-
-	Args:
-		query (str): The search query.
-		k (int): The number of results to return.
-
-	Returns:
-		Tuple[float, Dict]: The execution time and search results.
-	"""
-	
-	s = st.session_state.pinecone_object
-
-	start_time = time.time()
-	res = s.execute_query(query, k=k)
-
-	execution_time = time.time() - start_time
-
-	return execution_time, res
-
-
-@st.cache_data
-def get_data() -> pd.DataFrame:
-	"""
-	Loads the processed offers data and caches data for efficiency.
-
-	Returns:
-		pd.DataFrame: The processed offers data.
-	"""
-	
-	data = pd.read_csv('data/processed_offers.csv')
-	return data
-
-
-def perform_rag(df: pd.DataFrame) -> str:
-	"""
-	Performs retrieval-augmented generation (RAG) using the extracted categories.
-
-	Args:
-		df (pd.DataFrame): The DataFrame containing categories.
-
-	Returns:
-		str: The generated recommendations based on categories.
-	"""
-	
-	categories = list(df["categories"])
-	parsed_cats = set()
-	for full_cat in categories:
-		full_cat = full_cat.replace("{", "").replace("}", "")
-		full_cat = full_cat.split(", ")
-		for c in full_cat:
-			parsed_cats.add(c)
-		
-	cat_str = ", ".join(parsed_cats)
-
-	prompt = """
-	Given these categories of items:
-
-	{CAT_STR}
-
-	Could you provide recommendations of items to purchase and where to find them?
-	Provide your response in the following format:
-
-	Category 1 name: \n
-	Recommendation: \n
-	Where to find: \n 
-
-	Category 2: \n
-	Recommendation: \n
-	Where to find: \n  
-	...
-	Use a bulleted list
-	"""
-
-
-	template = PromptTemplate(template=prompt, input_variables=["cat_str"])
-	chain = LLMChain(llm=llm, prompt=template)
-	response = chain.invoke({"CAT_STR":cat_str})
-	# print(response)
-	return response
-
-
-def get_corresponding_ret_brands(conn: psycopg2.extensions.connection, ids: List[str]) -> pd.DataFrame:
-	"""
-	Fetches corresponding retailers and brands for a list of IDs.
-
-	Args:
-		conn (psycopg2.extensions.connection): The database connection.
-		ids (List[str]): The list of IDs to fetch data for.
-
-	Returns:
-		pd.DataFrame: A DataFrame containing retailer and brand information.
-	"""
-
-	placeholders = ', '.join(['%s'] * len(ids))
-	query = f"SELECT * FROM coupons.offer WHERE offer_id IN ({placeholders})"
-	test_df = psql.read_sql(query, conn, params=ids)
-	return test_df
+	slot.dataframe(enriched_df[["offer", "retailer", "brand"]])
 
 
 def main():
-	host = "localhost"
-	name = "couponsdb"
-	user = "calvinyu"
-	password = "password"
-
-	conn, curr = connect_to_db(host, name, user, password)
-
-	data = get_data()
-
-	if "searcher" not in st.session_state:
-		pine = pine_searcher.Searcher("beta-index")
-		st.session_state.pinecone_object = pine
+	backend = get_backend()
 
 	col1, col2 = st.columns(2)
 
@@ -207,6 +49,11 @@ def main():
 														"offers for cheap candy"])
 		k = st.slider('Number of results (k)', 1, 10, 5)  # default value is 5
 
+		with st.expander('Filters'):
+			retailer = st.text_input('Retailer')
+			brand = st.text_input('Brand')
+			category = st.text_input('Category (includes its subcategories)')
+
 	with col2:
 		query = st.text_input('Or enter a custom query')
 
@@ -218,17 +65,38 @@ def main():
 
 	if search_button:
 		if query:
-			execution_time, res = execute_search(query, k)
+			execution_time, df = backend.search(query, k, retailer=retailer or None,
+												brand=brand or None, category=category or None)
 			st.header(f"Execution time: {execution_time} seconds")
-			pine_ids = parse_pine(res)
-			df = convert_to_df(pine_ids, data)
-			brand_df = get_corresponding_ret_brands(conn, pine_ids)
-			result_df = pd.merge(df, brand_df, left_on='ids', right_on='offer_id', how='inner')
+			categories = rag.collect_categories(df["categories"])
+
+			table_slot = st.empty()
+			text_slot = st.empty()
+
+			# The LLM only needs the categories, so it streams while the DB lookup runs
+			with ThreadPoolExecutor(max_workers=1) as pool:
+				enriched_future = pool.submit(backend.enrich, retrieval.expand_members(df))
+				shown = False
+				response = ""
+				start_time = time.time()
+				first_token_time = None
+
+				for token in backend.stream_rag(categories):
+					if first_token_time is None:
+						first_token_time = time.time() - start_time
+					response += token
+					text_slot.markdown(response)
+
+					if not shown and enriched_future.done():
+						show_results(table_slot, enriched_future.result())
+						shown = True
+
+				if not shown:
+					show_results(table_slot, enriched_future.result())
 
-			st.dataframe(result_df[["offer", "retailer", "brand"]])
-			response = perform_rag(df)
-			st.write(response["text"])
+			if first_token_time is not None:
+				st.caption(f"Time to first token: {first_token_time:.2f} seconds")
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
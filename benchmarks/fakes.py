@@ -0,0 +1,92 @@
+# Deterministic offline stand-ins for the models and services used by the pipeline
+
+import hashlib
+import re
+from typing import List, Union
+
+import numpy as np
+
+
+class FakeEncoder():
+	"""
+	A deterministic bag-of-words encoder with the SentenceTransformer `encode`
+	interface. Every token maps to a fixed random vector, so texts sharing words
+	get similar, unit-normalized embeddings.
+	"""
+
+	def __init__(self, dimension: int = 384) -> None:
+		self.dimension = dimension
+		self._tokens = {}
+
+	def _token(self, token: str) -> np.ndarray:
+		vector = self._tokens.get(token)
+		if vector is None:
+			seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+			vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+			self._tokens[token] = vector
+		return vector
+
+	def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+		single = isinstance(sentences, str)
+		texts = [sentences] if single else list(sentences)
+
+		out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+		for i, text in enumerate(texts):
+			for token in re.findall(r"\w+", text.lower()):
+				out[i] += self._token(token)
+			out[i] /= np.linalg.norm(out[i]) or 1.0
+
+		return out[0] if single else out
+
+
+class FakeReranker():
+	"""
+	A deterministic cross-encoder stand-in scoring pairs by word overlap.
+	"""
+
+	def compute_score(self, pairs, batch_size: int = 32, **kwargs):
+		if pairs and isinstance(pairs[0], str):
+			pairs = [pairs]
+
+		scores = []
+		for query, passage in pairs:
+			q, p = set(re.findall(r"\w+", query.lower())), set(re.findall(r"\w+", passage.lower()))
+			scores.append(len(q & p) / (len(q) or 1))
+
+		return scores[0] if len(scores) == 1 else scores
+
+
+def fake_classifier(offers: List[str], candidate_labels: List[str], batch_size: int = 16, **kwargs) -> List[dict]:
+	"""
+	A zero-shot pipeline stand-in that ranks labels by a hash of the offer.
+	"""
+
+	results = []
+	for offer in offers:
+		seed = int.from_bytes(hashlib.sha256(offer.encode("utf-8")).digest()[:8], "little")
+		scores = np.random.default_rng(seed).dirichlet(np.ones(len(candidate_labels)))
+		order = np.argsort(-scores)
+		results.append({"sequence": offer, "labels": [candidate_labels[i] for i in order],
+						"scores": [float(scores[i]) for i in order]})
+	return results
+
+
+def install(index_root: str) -> None:
+	"""
+	Routes the pipeline to the offline stand-ins: the fake encoder, reranker and
+	classifier, the local vector index under `index_root` and the stub LLM.
+
+	Args:
+		index_root (str): The directory local indexes are written to.
+	"""
+
+	import rag
+	from db import data_preprocess
+	from pinecone_model import utils
+
+	utils._models["embedding"] = FakeEncoder()
+	utils._models["reranker"] = FakeReranker()
+	utils.backend = "local"
+	utils.local_params["root"] = index_root
+	data_preprocess._classifier = fake_classifier
+	rag._llm = rag.StubLLM()
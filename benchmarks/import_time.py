@@ -0,0 +1,65 @@
+# Guards against startup regressions: importing the search package must stay cheap
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Heavy modules that should only be imported once a model is actually used
+HEAVY_MODULES = ["torch", "sentence_transformers", "FlagEmbedding", "transformers"]
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeats: int = 3) -> dict:
+	"""
+	Imports a module in fresh interpreters and records the fastest import time.
+
+	Args:
+		module (str): The module to import.
+		repeats (int): The number of fresh interpreters to try.
+
+	Returns:
+		dict: The best import time in seconds and any heavy modules it pulled in.
+	"""
+
+	runs = []
+	for _ in range(repeats):
+		out = subprocess.run([sys.executable, "-c", SNIPPET.format(module=module, heavy=HEAVY_MODULES)],
+							 cwd=ROOT, capture_output=True, text=True, check=True)
+		runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+	return min(runs, key=lambda r: r["seconds"])
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Checks the import time of the search package.")
+	parser.add_argument("--module", default="pinecone_model.searcher")
+	parser.add_argument("--max-seconds", type=float, default=2.0)
+	parser.add_argument("--repeats", type=int, default=3)
+	args = parser.parse_args()
+
+	result = measure(args.module, args.repeats)
+	print(f"import {args.module}: {result['seconds']:.3f}s, heavy modules loaded: {result['loaded'] or 'none'}")
+
+	if result["loaded"]:
+		print("FAIL: model libraries are imported eagerly")
+		return 1
+	if result["seconds"] > args.max_seconds:
+		print(f"FAIL: import took longer than {args.max_seconds}s")
+		return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,149 @@
+# Reports recall and latency of quantized index storage and query encoders against the fp32 baseline
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import fakes
+import synthetic
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def recall(results: List[List[str]], baseline: List[List[str]]) -> float:
+	"""
+	Returns:
+		float: The mean fraction of each baseline result list found in `results`.
+	"""
+
+	return float(np.mean([len(set(r) & set(b)) / (len(b) or 1) for r, b in zip(results, baseline)]))
+
+
+def search(index, queries: np.ndarray, k: int):
+	"""
+	Runs the queries one at a time.
+
+	Returns:
+		The matched IDs of every query and the p50/p99 latency in milliseconds.
+	"""
+
+	ids, latencies = [], []
+	for q in queries:
+		start = time.perf_counter()
+		res = index.query(q, top_k=k)
+		latencies.append((time.perf_counter() - start) * 1000)
+		ids.append([m["id"] for m in res["matches"]])
+
+	return ids, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def bench_storage(vectors: np.ndarray, queries: np.ndarray, k: int, rescore: int, root: str) -> Dict:
+	"""
+	Builds one local index per quantization and compares each with the float32 flat index.
+	"""
+
+	from pinecone_model.local_index import LocalIndex
+
+	results, baseline = {}, None
+	for quantization in ["none", "int8", "binary"]:
+		index = LocalIndex(f"quant-{quantization}", root=root, dimension=vectors.shape[1],
+						   mode="flat", quantization=quantization, rescore=rescore, autosave=False)
+		index.upsert([(str(i), v, {}) for i, v in enumerate(vectors)])
+		index.save()
+
+		ids, p50, p99 = search(index, queries, k)
+		baseline = baseline or ids
+		scanned = index._codes if index._codes is not None else index._vectors
+		results[quantization] = {"recall": recall(ids, baseline), "p50_ms": p50, "p99_ms": p99,
+								 "scanned_bytes_per_vector": scanned.nbytes / len(vectors)}
+
+	return results
+
+
+def bench_encoders(texts: List[str], queries: List[str], kinds: List[str], k: int, root: str) -> Dict:
+	"""
+	Indexes the offers with the fp32 encoder and compares query encoding time and
+	results of every other encoder against it.
+	"""
+
+	from pinecone_model import utils
+	from pinecone_model.local_index import LocalIndex
+
+	models = {kind: utils.build_embedding_model(kind) for kind in ["fp32"] + [k for k in kinds if k != "fp32"]}
+
+	vectors = models["fp32"].encode(texts, batch_size=64)
+	index = LocalIndex("encoders", root=root, dimension=vectors.shape[1], mode="flat",
+					   quantization="none", autosave=False)
+	index.upsert([(str(i), v, {}) for i, v in enumerate(vectors)])
+	index.save()
+
+	results, baseline = {}, None
+	for kind, model in models.items():
+		model.encode(queries[0])
+		latencies, encoded = [], []
+		for q in queries:
+			start = time.perf_counter()
+			encoded.append(model.encode(q))
+			latencies.append((time.perf_counter() - start) * 1000)
+
+		ids, _, _ = search(index, np.asarray(encoded), k)
+		baseline = baseline or ids
+		results[kind] = {"recall": recall(ids, baseline),
+						 "encode_p50_ms": float(np.percentile(latencies, 50)),
+						 "encode_p99_ms": float(np.percentile(latencies, 99))}
+
+	return results
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Compares quantized storage and encoders with the fp32 baseline.")
+	parser.add_argument("--scale", type=float, default=10.0)
+	parser.add_argument("--queries", type=int, default=200)
+	parser.add_argument("--k", type=int, default=10)
+	parser.add_argument("--rescore", type=int, default=4)
+	parser.add_argument("--encoders", default="",
+						help="comma-separated encoders to compare with fp32, e.g. int8,onnx (downloads the model)")
+	args = parser.parse_args()
+
+	tables = synthetic.generate(args.scale)
+	texts = [str(o) for o in tables["processed_offers.csv"]["OFFER"]]
+	rng = np.random.default_rng(1)
+	queries = [" ".join(texts[i].split()[:3]) for i in rng.integers(0, len(texts), args.queries)]
+
+	encoder = fakes.FakeEncoder()
+	results = {"scale": args.scale, "offers": len(texts), "k": args.k, "rescore": args.rescore,
+			   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+	with tempfile.TemporaryDirectory() as tmp:
+		results["storage"] = bench_storage(encoder.encode(texts), encoder.encode(queries), args.k, args.rescore, tmp)
+		kinds = [k for k in args.encoders.split(",") if k]
+		if kinds:
+			results["encoders"] = bench_encoders(texts, queries, kinds, args.k, tmp)
+
+	print(f"{'storage':10s} {'recall':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'bytes/vec':>10s}")
+	for name, r in results["storage"].items():
+		print(f"{name:10s} {r['recall']:8.3f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f} {r['scanned_bytes_per_vector']:10.0f}")
+	for name, r in results.get("encoders", {}).items():
+		print(f"encoder {name:6s} recall {r['recall']:.3f} encode p50 {r['encode_p50_ms']:.2f} ms")
+
+	RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+	out = RESULTS_DIR / f"quantization-{time.strftime('%Y%m%d-%H%M%S')}-x{args.scale:g}.json"
+	with open(out, "w") as f:
+		json.dump(results, f, indent=2)
+	print(f"Saved {out}")
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
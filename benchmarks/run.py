@@ -0,0 +1,189 @@
+# Benchmarks preprocessing, DB loading, indexing and search on synthetic catalogs
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import fakes
+import synthetic
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def bench_preprocess(tables: Dict[str, pd.DataFrame], data_dir: str) -> Dict:
+	"""
+	Measures ID hashing and zero-shot categorization throughput, and the stage
+	timings of a full preprocessing run over the catalog in `data_dir`.
+	"""
+
+	from db.data_preprocess import classify_offers, hash_ids, preprocess
+
+	offers = tables["offer_retailer.csv"]
+	start = time.perf_counter()
+	hash_ids(offers["OFFER"], offers["RETAILER"])
+	hash_seconds = time.perf_counter() - start
+
+	specific = offers[offers["RETAILER"] != offers["BRAND"]].merge(tables["brand_category.csv"], on="BRAND")
+	offer_labels = specific.groupby("OFFER", sort=False)["BRAND_BELONGS_TO_CATEGORY"].agg(lambda x: list(dict.fromkeys(x))).to_dict()
+	start = time.perf_counter()
+	classify_offers(offer_labels, cache_path=None)
+	classify_seconds = time.perf_counter() - start
+
+	stages = preprocess(data_dir, cache_path=None)
+
+	return {"hash_rows_per_sec": len(offers) / hash_seconds,
+			"classify_rows_per_sec": len(offer_labels) / classify_seconds if classify_seconds else None,
+			"stage_ms": {name: seconds * 1000 for name, seconds in stages.items()}}
+
+
+def bench_db_load(data_dir: str) -> Optional[Dict]:
+	"""
+	Measures DBDriver load throughput. Only runs when BENCH_DB_NAME names a
+	scratch database, since the coupons tables in it are replaced.
+	"""
+
+	if not os.environ.get("BENCH_DB_NAME"):
+		return None
+
+	from db.db_setup import DBDriver
+	from db.queries import create_schema, create_tables, delete_tables
+
+	db = DBDriver(host=os.environ.get("BENCH_DB_HOST", "localhost"), name=os.environ["BENCH_DB_NAME"],
+				  user=os.environ.get("BENCH_DB_USER", "postgres"), password=os.environ.get("BENCH_DB_PASSWORD", ""))
+	db.execute_query(create_schema)
+	for d in delete_tables:
+		db.execute_query(d)
+	for c in create_tables:
+		db.execute_query(c)
+
+	results = {}
+	for csv_file, table in [("categories.csv", "coupons.categories"), ("brand_category.csv", "coupons.brand"),
+							("offer_retailer.csv", "coupons.offer")]:
+		results[table] = db.insert_from_csv(os.path.join(data_dir, csv_file), table)
+
+	return {"rows_per_sec": results}
+
+
+def bench_index(processed: pd.DataFrame, offers: pd.DataFrame, index_name: str) -> Dict:
+	"""
+	Measures indexer throughput into the local vector index, in memory and
+	streamed from a CSV.
+	"""
+
+	from pinecone_model import indexer
+
+	pc = indexer.PineCone(index_name, backend="local")
+	rows_per_sec = pc.index_data(indexer.parse_data(processed, offers))
+
+	streamed = indexer.PineCone(f"{index_name}-stream", backend="local")
+	processed_path = os.path.join(os.path.dirname(streamed.index.path), "processed_offers.csv")
+	processed.to_csv(processed_path, index=False)
+	stream_rows_per_sec = streamed.index_stream(processed_path, offers, checkpoint=False)
+
+	return {"rows_per_sec": rows_per_sec, "stream_rows_per_sec": stream_rows_per_sec}
+
+
+def bench_search(processed: pd.DataFrame, index_name: str, n_queries: int, k: int) -> Dict:
+	"""
+	Measures single-query latency percentiles and batch search throughput.
+	"""
+
+	from pinecone_model.searcher import Searcher
+
+	rng = np.random.default_rng(1)
+	offers = processed["OFFER"].values
+	# unique queries so the embedding cache does not hide encoder cost
+	queries = [" ".join(str(offers[i]).split()[:3]) + f" {j}" for j, i in enumerate(rng.integers(0, len(offers), n_queries))]
+
+	searcher = Searcher(index_name, backend="local")
+	latencies = []
+	for q in queries:
+		start = time.perf_counter()
+		searcher.execute_query(q, k=k)
+		latencies.append((time.perf_counter() - start) * 1000)
+
+	searcher.query_cache.clear()
+	batch = searcher.execute_many([q + " batch" for q in queries], k=k)
+
+	return {"queries": n_queries,
+			"p50_ms": float(np.percentile(latencies, 50)),
+			"p99_ms": float(np.percentile(latencies, 99)),
+			"batch_total_ms": batch["timing"]["total_ms"],
+			"batch_queries_per_sec": n_queries / (batch["timing"]["total_ms"] / 1000)}
+
+
+def compare(current: Dict, previous_path: str) -> None:
+	"""
+	Prints every numeric result next to the same result of an earlier run.
+	"""
+
+	with open(previous_path) as f:
+		previous = json.load(f)
+
+	def flatten(d, prefix=""):
+		for key, value in d.items():
+			if isinstance(value, dict):
+				yield from flatten(value, f"{prefix}{key}.")
+			elif isinstance(value, (int, float)) and not isinstance(value, bool):
+				yield f"{prefix}{key}", value
+
+	before = dict(flatten(previous))
+	for key, value in flatten(current):
+		if key in before and before[key]:
+			print(f"{key:45s} {before[key]:12.2f} -> {value:12.2f} ({value / before[key]:.2f}x)")
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Benchmarks the pipeline on a synthetic catalog.")
+	parser.add_argument("--scale", type=float, default=10.0)
+	parser.add_argument("--queries", type=int, default=200)
+	parser.add_argument("--k", type=int, default=5)
+	parser.add_argument("--compare", help="an earlier results file to compare against")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		fakes.install(os.path.join(tmp, "index"))
+
+		start = time.perf_counter()
+		tables = synthetic.generate(args.scale)
+		synthetic.write(tables, tmp)
+		generate_seconds = time.perf_counter() - start
+
+		index_name = f"bench-{args.scale:g}"
+		results = {"scale": args.scale,
+				   "offers": len(tables["offer_retailer.csv"]),
+				   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+				   "generate_seconds": generate_seconds,
+				   "preprocess": bench_preprocess(tables, tmp),
+				   "db_load": bench_db_load(tmp),
+				   "index": bench_index(tables["processed_offers.csv"], tables["offer_retailer.csv"], index_name),
+				   "search": bench_search(tables["processed_offers.csv"], index_name, args.queries, args.k)}
+
+	RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+	out = RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-x{args.scale:g}.json"
+	with open(out, "w") as f:
+		json.dump(results, f, indent=2)
+
+	print(json.dumps(results, indent=2))
+	print(f"Saved {out}")
+
+	if args.compare:
+		compare(results, args.compare)
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,46 @@
+# Measures search throughput and latency of a running search service
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from retrieval import SearchClient
+
+QUERIES = ["im looking for coupons related to pepsi",
+		   "thanksgiving coupons",
+		   "offers for cheap candy"]
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Load-tests the /search endpoint.")
+	parser.add_argument("--url", default="http://localhost:8000")
+	parser.add_argument("--requests", type=int, default=500)
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--k", type=int, default=5)
+	args = parser.parse_args()
+
+	client = SearchClient(args.url)
+
+	def timed(i: int) -> float:
+		start = time.perf_counter()
+		client.search(QUERIES[i % len(QUERIES)], args.k)
+		return time.perf_counter() - start
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+		latencies = np.array(list(pool.map(timed, range(args.requests))))
+	elapsed = time.perf_counter() - start
+
+	print(f"{args.requests} requests in {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s), "
+		  f"p50 {np.percentile(latencies, 50) * 1000:.1f}ms, p99 {np.percentile(latencies, 99) * 1000:.1f}ms")
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
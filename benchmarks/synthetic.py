@@ -0,0 +1,104 @@
+# Generates synthetic catalogs with the same schemas as the CSV files in data/
+
+import argparse
+import os
+import sys
+import uuid
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from db.data_preprocess import generate_unique_id
+
+# Sizes of the real catalog, multiplied by the scale factor
+BASE_SIZES = {"offers": 384, "brands": 144, "brand_categories": 9906, "categories": 118, "parents": 23, "retailers": 60}
+
+PRODUCTS = ["chips", "soda", "water", "yogurt", "cereal", "coffee", "pasta sauce", "frozen pizza", "candy",
+			"shampoo", "diapers", "dog food", "paper towels", "ice cream", "beer", "sparkling water",
+			"granola bars", "cheese", "plant-based burgers", "energy drink"]
+
+TEMPLATES = ["{brand} {product}, select varieties",
+			 "Spend ${amount} on {brand} {product}",
+			 "Buy {count} {brand} {product} at {retailer}",
+			 "{brand} {product}, {amount} ounce or larger",
+			 "Save on {brand} {product} at {retailer}"]
+
+
+def generate(scale: float = 1.0, seed: int = 0) -> Dict[str, pd.DataFrame]:
+	"""
+	Generates categories, brand categories, offers and processed offers.
+
+	Args:
+		scale (float): The catalog size relative to the current CSV files.
+		seed (int): The random seed, so runs at the same scale are identical.
+
+	Returns:
+		Dict[str, pd.DataFrame]: The tables keyed by their CSV file name.
+	"""
+
+	rng = np.random.default_rng(seed)
+	sizes = {name: max(1, int(size * scale)) for name, size in BASE_SIZES.items()}
+	sizes["parents"] = BASE_SIZES["parents"]
+
+	parents = [f"Department {i}" for i in range(sizes["parents"])]
+	children = [f"{PRODUCTS[i % len(PRODUCTS)].title()} {i}" for i in range(sizes["categories"])]
+	categories = pd.DataFrame({"CATEGORY_ID": [str(uuid.UUID(bytes=rng.bytes(16))) for _ in children],
+							   "PRODUCT_CATEGORY": children,
+							   "IS_CHILD_CATEGORY_TO": rng.choice(parents, len(children))})
+
+	brands = [f"BRAND {i}" for i in range(sizes["brands"])]
+	retailers = [f"RETAILER {i}" for i in range(sizes["retailers"])]
+	category_rows = rng.integers(0, len(categories), sizes["brand_categories"])
+	brand_category = pd.DataFrame({"BRAND": rng.choice(brands, sizes["brand_categories"]),
+								   "BRAND_BELONGS_TO_CATEGORY": categories["PRODUCT_CATEGORY"].values[category_rows],
+								   "RECEIPTS": rng.integers(1, 3_000_000, sizes["brand_categories"]),
+								   "CATEGORY_ID": categories["CATEGORY_ID"].values[category_rows]})
+
+	offer_brands = rng.choice(brands, sizes["offers"])
+	offer_retailers = np.where(rng.random(sizes["offers"]) < 0.4, "not retailer specific",
+							   rng.choice(retailers, sizes["offers"]))
+	offers = [TEMPLATES[rng.integers(len(TEMPLATES))].format(brand=b.title(), product=PRODUCTS[rng.integers(len(PRODUCTS))],
+															 amount=int(rng.integers(5, 60)), count=int(rng.integers(2, 6)),
+															 retailer=r.title()) + f" #{i}"
+			  for i, (b, r) in enumerate(zip(offer_brands, offer_retailers))]
+	offer_retailer = pd.DataFrame({"OFFER": offers, "RETAILER": offer_retailers, "BRAND": offer_brands})
+	offer_retailer["UNIQUE_ID"] = [generate_unique_id(o, r) for o, r in zip(offers, offer_retailers)]
+
+	brand_labels = brand_category.groupby("BRAND")["BRAND_BELONGS_TO_CATEGORY"].agg(lambda x: sorted(set(x))[:3]).to_dict()
+	processed_offers = pd.DataFrame({"OFFER": offer_retailer["OFFER"],
+									 "CATEGORY": [str(set(brand_labels.get(b, [children[0]]))) for b in offer_brands],
+									 "UNIQUE_ID": offer_retailer["UNIQUE_ID"]}).reset_index()
+
+	return {"categories.csv": categories, "brand_category.csv": brand_category,
+			"offer_retailer.csv": offer_retailer, "processed_offers.csv": processed_offers}
+
+
+def write(tables: Dict[str, pd.DataFrame], out_dir: str) -> None:
+	"""
+	Writes the generated tables as CSV files.
+	"""
+
+	os.makedirs(out_dir, exist_ok=True)
+	for name, table in tables.items():
+		table.to_csv(os.path.join(out_dir, name), index=False)
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Generates a synthetic coupon catalog.")
+	parser.add_argument("--scale", type=float, default=10.0)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--out", default="benchmarks/synthetic_data")
+	args = parser.parse_args()
+
+	tables = generate(args.scale, args.seed)
+	write(tables, args.out)
+	print(", ".join(f"{name}: {len(table)} rows" for name, table in tables.items()))
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,6 +1,17 @@
 import pandas as pd
 import hashlib
-from transformers import pipeline
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Dict, List, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+ZERO_SHOT_MODEL = "facebook/bart-large-mnli"
+ZERO_SHOT_CACHE = os.path.join(DATA_DIR, 'zero_shot_cache.jsonl')
+
+# Loaded once per worker process by _init_classifier
+_classifier = None
 
 def generate_unique_id(offer: str, retailer: str) -> str:
     """
@@ -18,108 +29,390 @@ def generate_unique_id(offer: str, retailer: str) -> str:
     return hashlib.sha256(key.encode('utf-8')).hexdigest()
 
 
-def add_unique_ids_offers() -> None:
+def hash_ids(offers: pd.Series, retailers: pd.Series) -> List[str]:
     """
-    Adds unique identifiers (UNIQUE_ID) to offers in `offer_retailer.csv` and 
-    maps them to the processed offers in `processed_offers.csv`.
+    Generates the unique IDs of many offers at once, matching generate_unique_id.
+    The keys are built with vectorized string operations and hashed in a single
+    pass instead of a row-wise DataFrame.apply.
+
+    Args:
+        offers (pd.Series): The offer descriptions.
+        retailers (pd.Series): The retailer names.
+
+    Returns:
+        List[str]: The hash of each offer.
     """
 
-    processed_df = pd.read_csv("../data/processed_offers.csv")
-    offer_df = pd.read_csv("../data/offer_retailer.csv")
- 
-    # Generate a unique ID and map offers between tables
-    offer_df['UNIQUE_ID'] = offer_df.apply(lambda row: generate_unique_id(row['OFFER'], row['RETAILER']), axis=1)
-    offer_id_mapping = offer_df.set_index('OFFER')['UNIQUE_ID'].to_dict()
+    retailers = retailers.astype(object).where(retailers.notna(), "nan").astype(str).replace("", "Unknown")
+    keys = offers.astype(str) + "-" + retailers
+    sha256 = hashlib.sha256
+    return [sha256(key.encode('utf-8')).hexdigest() for key in keys]
 
-    # Apply mapping
-    processed_df['UNIQUE_ID'] = processed_df['OFFER'].map(offer_id_mapping)
 
-    # Save as a new csv
-    offer_df.to_csv("../data/offer_retailer.csv", index=False)
-    processed_df.to_csv("../data/processed_offers.csv", index=False)
+def add_unique_ids_offers(offer_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds unique identifiers (UNIQUE_ID) to the offers.
 
+    Args:
+        offer_df (pd.DataFrame): The rows of `offer_retailer.csv`.
 
-def add_unique_ids_categories() -> None:
+    Returns:
+        pd.DataFrame: The offers with a UNIQUE_ID column.
     """
-    Maps categories to the corresponding brand categories by adding CATEGORY_ID
-    to `brand_category.csv` based on the `categories.csv` data.
+
+    return offer_df.assign(UNIQUE_ID=hash_ids(offer_df['OFFER'], offer_df['RETAILER']))
+
+
+def map_unique_ids(processed_df: pd.DataFrame, offer_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Maps the UNIQUE_ID of each offer onto the processed offers.
+
+    Args:
+        processed_df (pd.DataFrame): The grouped offers.
+        offer_df (pd.DataFrame): The offers with their UNIQUE_ID.
+
+    Returns:
+        pd.DataFrame: The processed offers with a UNIQUE_ID column.
     """
 
-    categories_df = pd.read_csv("../data/categories.csv")
-    brand_category_df = pd.read_csv("../data/brand_category.csv")
+    offer_id_mapping = dict(zip(offer_df['OFFER'], offer_df['UNIQUE_ID']))
+    return processed_df.assign(UNIQUE_ID=processed_df['OFFER'].map(offer_id_mapping))
+
+
+def add_unique_ids_categories(brand_category_df: pd.DataFrame, categories_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Maps categories to the corresponding brand categories by adding CATEGORY_ID
+    to the brand categories based on the categories data.
+
+    Args:
+        brand_category_df (pd.DataFrame): The rows of `brand_category.csv`.
+        categories_df (pd.DataFrame): The rows of `categories.csv`.
+
+    Returns:
+        pd.DataFrame: The brand categories with a CATEGORY_ID column.
+    """
 
-    # Generate a mapping between tables and missing IDs
     category_mapping = dict(zip(categories_df['PRODUCT_CATEGORY'], categories_df['CATEGORY_ID']))
-    brand_category_df['CATEGORY_ID'] = brand_category_df['BRAND_BELONGS_TO_CATEGORY'].map(category_mapping)
+    return brand_category_df.assign(CATEGORY_ID=brand_category_df['BRAND_BELONGS_TO_CATEGORY'].map(category_mapping))
 
-    # Save as a new df
-    brand_category_df.to_csv("../data/brand_category.csv", index=False)
 
+def fill_retailer(offer_rets: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fills missing or empty values in the RETAILER column with "not retailer specific".
+
+    Args:
+        offer_rets (pd.DataFrame): The rows of `offer_retailer.csv`.
 
-def fill_retailer() -> None:
+    Returns:
+        pd.DataFrame: The offers with every retailer filled in.
+    """
+
+    return offer_rets.assign(RETAILER=offer_rets['RETAILER'].replace("", "not retailer specific").fillna("not retailer specific"))
+
+
+def _init_classifier() -> None:
+    """
+    Loads the zero-shot pipeline once per process.
     """
-    Fills missing or empty values in the RETAILER column of `offer_retailer.csv`
-    with "not retailer specific".
+
+    global _classifier
+    from transformers import pipeline
+
+    _classifier = pipeline(task="zero-shot-classification", model=ZERO_SHOT_MODEL)
+
+
+def _classify_batch(job: Tuple[List[str], List[str], int]) -> List[Dict]:
+    """
+    Classifies a batch of offers that share the same candidate labels.
+
+    Args:
+        job (Tuple[List[str], List[str], int]): The offers, their candidate labels
+            and the pipeline batch size.
+
+    Returns:
+        List[Dict]: The pipeline outputs, one per offer.
+    """
+
+    if _classifier is None:
+        _init_classifier()
+
+    offers, labels, batch_size = job
+    results = _classifier(offers, candidate_labels=labels, batch_size=batch_size)
+    return results if isinstance(results, list) else [results]
+
+
+def _cache_key(offer: str, labels: List[str]) -> str:
+    """
+    Hashes an offer with its candidate label set.
+    """
+
+    key = "\x1f".join([offer] + sorted(labels))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def classify_offers(offer_labels: Dict[str, List[str]], workers: int = 1, batch_size: int = 16,
+                    cache_path: str = ZERO_SHOT_CACHE) -> Dict[str, Dict]:
+    """
+    Runs zero-shot classification for every offer against its candidate labels.
+    Offers with identical label sets are batched through the pipeline together,
+    batches are spread across `workers` processes and results are cached on disk
+    keyed by the (offer, label set) hash. Each batch is appended to the cache as
+    soon as it completes, so an interrupted run keeps the work already done.
+
+    Args:
+        offer_labels (Dict[str, List[str]]): The candidate labels of each offer.
+        workers (int): The number of classifier processes.
+        batch_size (int): The number of offers per pipeline call.
+        cache_path (str): The JSON lines file holding previous results, or None to disable caching.
+
+    Returns:
+        Dict[str, Dict]: The pipeline output of each offer.
     """
 
-    offer_rets = pd.read_csv("../data/offer_retailer.csv")
-    offer_rets['RETAILER'] = offer_rets['RETAILER'].replace("", "not retailer specific").fillna("not retailer specific")
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        line = ""
+        with open(cache_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted run may be partial
+                    continue
+                cache[entry["key"]] = entry["output"]
+        if line and not line.endswith("\n"):
+            with open(cache_path, "a") as f:
+                f.write("\n")
+
+    results = {}
+    pending = {}
+    for offer, labels in offer_labels.items():
+        key = _cache_key(offer, labels)
+        if key in cache:
+            results[offer] = cache[key]
+        else:
+            pending.setdefault(tuple(sorted(labels)), []).append(offer)
+
+    jobs = []
+    for labels, offers in pending.items():
+        for i in range(0, len(offers), batch_size):
+            jobs.append((offers[i:i + batch_size], list(labels), batch_size))
+
+    def record(job, batch):
+        offers, labels, _ = job
+        lines = []
+        for offer, output in zip(offers, batch):
+            output = {"labels": list(output["labels"]), "scores": [float(x) for x in output["scores"]]}
+            results[offer] = output
+            lines.append(json.dumps({"key": _cache_key(offer, labels), "output": output}) + "\n")
+
+        if cache_path:
+            with open(cache_path, "a") as f:
+                f.writelines(lines)
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_classifier) as pool:
+            futures = {pool.submit(_classify_batch, job): job for job in jobs}
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+    else:
+        for job in jobs:
+            record(job, _classify_batch(job))
+
+    print(f"Classified {len(offer_labels)} offers ({len(offer_labels) - sum(len(j[0]) for j in jobs)} cached)")
 
-    offer_rets.to_csv("../data/offer_retailer.csv", index=False)
+    return results
 
 
-def group_offers() -> None:
+def group_offers(offer_rets: pd.DataFrame, brand_cats: pd.DataFrame, workers: int = 1, batch_size: int = 16,
+                 cache_path: str = ZERO_SHOT_CACHE) -> pd.DataFrame:
     """
     Groups offers based on their categories using zero-shot classification 
     to associate offers with relevant product categories. Processes both generic
-    and specific offers, and saves the results to `processed_offers.csv`.
-    """
+    and specific offers.
 
-    pipe = pipeline(task="zero-shot-classification", model="facebook/bart-large-mnli")
-    brand_cats = pd.read_csv("../data/brand_category.csv")
-    offer_rets = pd.read_csv("../data/offer_retailer.csv")
+    Args:
+        offer_rets (pd.DataFrame): The offers with their retailers filled in.
+        brand_cats (pd.DataFrame): The rows of `brand_category.csv`.
+        workers (int): The number of classifier processes.
+        batch_size (int): The number of offers per pipeline call.
+        cache_path (str): The JSON lines file caching classifier results.
+
+    Returns:
+        pd.DataFrame: The processed offers with their category sets.
+    """
 
     generic_offers = offer_rets[offer_rets["RETAILER"] == offer_rets["BRAND"]].merge(brand_cats, left_on="BRAND", right_on="BRAND")
     grouped_generic = generic_offers.groupby('RETAILER').agg({'BRAND_BELONGS_TO_CATEGORY':lambda x: set(x)})
     labeled_generic_offers = offer_rets[offer_rets["RETAILER"] == offer_rets["BRAND"]].merge(grouped_generic, left_on="RETAILER", right_on="RETAILER")
         
     generic_offers_new = labeled_generic_offers[["OFFER", "BRAND_BELONGS_TO_CATEGORY"]].rename({"BRAND_BELONGS_TO_CATEGORY":"CATEGORY"}, axis=1)
-    specific_offers = offer_rets[offer_rets["RETAILER"] != offer_rets["BRAND"]].merge(brand_cats, left_on="BRAND", right_on="BRAND").head(500)
+    specific_offers = offer_rets[offer_rets["RETAILER"] != offer_rets["BRAND"]].merge(brand_cats, left_on="BRAND", right_on="BRAND")
 
+    # Candidate labels of every offer in a single pass
+    offer_labels = specific_offers.groupby("OFFER", sort=False)["BRAND_BELONGS_TO_CATEGORY"].agg(lambda x: list(dict.fromkeys(x))).to_dict()
+    classified = classify_offers(offer_labels, workers=workers, batch_size=batch_size, cache_path=cache_path)
 
-    completed_set = set()
     new_offers = {"OFFER": [], "CATEGORY":[]}
     threshold = 0.20
-    for i in range(len(specific_offers)):
-        offer = specific_offers.iloc[i]["OFFER"]
-        if offer not in completed_set:
-            related_cats = list(specific_offers[specific_offers["OFFER"] == offer]["BRAND_BELONGS_TO_CATEGORY"])
+    for offer in offer_labels:
+        labels = classified[offer]
+        thresholded_labels = [l for i, l in enumerate(labels["labels"]) if labels["scores"][i] > threshold]
+        if len(thresholded_labels) == 0:
+            new_offers["CATEGORY"].append({labels["labels"][0]})
+        else:
+            new_offers["CATEGORY"].append(set(thresholded_labels))
+        new_offers["OFFER"].append(offer)
+
+    specific_offers_new = pd.DataFrame(new_offers)
+    return pd.concat([specific_offers_new, generic_offers_new]).reset_index()
 
-            labels = pipe(offer,
-            candidate_labels=related_cats)
 
-            thresholded_labels = [l for i, l in enumerate(labels["labels"]) if labels["scores"][i] > threshold]
-            if len(thresholded_labels) == 0:
-                new_offers["CATEGORY"].append({labels["labels"][0]})
-            else:
-                new_offers["CATEGORY"].append(set(thresholded_labels))
-            new_offers["OFFER"].append(offer)
-            completed_set.add(offer)
+def run_stages(stages: Dict[str, Tuple[Callable, List[str]]], workers: int = 4,
+               on_result: Callable = None) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs a DAG of stages on a thread pool, starting each stage as soon as the
+    stages it depends on have finished, so independent stages run in parallel.
 
-            print(offer)
-            print(set(thresholded_labels))
+    Args:
+        stages (Dict[str, Tuple[Callable, List[str]]]): The function of each stage
+            and the stages whose results it takes as arguments, in order.
+        workers (int): The number of stages run at once.
+        on_result (Callable): Called with the name and result of every finished stage.
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, float]]: The result and the duration in
+        seconds of every stage.
+    """
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        return fn(*args), time.perf_counter() - start
+
+    results, timings = {}, {}
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name, (fn, deps) in list(pending.items()):
+                if all(d in results for d in deps):
+                    running[pool.submit(timed, fn, *[results[d] for d in deps])] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Stages with unmet dependencies: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+                if on_result:
+                    on_result(name, results[name])
+
+    return results, timings
+
+
+def write_intermediate(directory: str, name: str, result: Any) -> None:
+    """
+    Writes a DataFrame stage result as a pickle, which keeps set-valued columns
+    as sets and, like the offer snapshot, needs nothing beyond pandas and NumPy.
+    Load one with `pd.read_pickle`.
+
+    Args:
+        directory (str): The directory of the intermediates.
+        name (str): The stage name.
+        result (Any): The stage result; anything but a DataFrame is skipped.
+    """
+
+    if not isinstance(result, pd.DataFrame):
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    result.to_pickle(os.path.join(directory, f"{name}.pkl"))
+
+
+def snapshot(processed: pd.DataFrame, path: str) -> int:
+    """
+    Writes the offer snapshot. pinecone_model is imported here rather than at
+    module level, so importing this module does not need the repository root on
+    the path.
+
+    Args:
+        processed (pd.DataFrame): The processed offers with UNIQUE_ID.
+        path (str): The snapshot directory.
+
+    Returns:
+        int: The number of offers written.
+    """
+
+    from pinecone_model.snapshot import write_snapshot
+
+    return write_snapshot(processed, path)
+
+
+def preprocess(data_dir: str = DATA_DIR, workers: int = 1, batch_size: int = 16,
+               cache_path: str = ZERO_SHOT_CACHE, intermediates_dir: str = None) -> Dict[str, float]:
+    """
+    Refreshes the derived columns of every dataset in one in-memory pass: each
+    CSV is read once, the stages hand DataFrames to each other and every changed
+    dataset is written once. Offers are grouped before their IDs are mapped,
+    so `processed_offers.csv` always carries UNIQUE_ID. The processed offers are
+    also written as the memory-mapped snapshot the search pipeline opens.
+
+    Args:
+        data_dir (str): The directory holding the CSV files.
+        workers (int): The number of classifier processes.
+        batch_size (int): The number of offers per pipeline call.
+        cache_path (str): The JSON file caching classifier results.
+        intermediates_dir (str): An optional directory every stage result is written to.
+
+    Returns:
+        Dict[str, float]: The duration of every stage in seconds.
+    """
+
+    path = lambda name: os.path.join(data_dir, name)
+    read = lambda name: (lambda: pd.read_csv(path(name)))
+
+    def write(offers, brand_cats, processed):
+        # the three outputs are independent files, so they are written together
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(df.to_csv, path(name), index=False)
+                       for df, name in [(offers, "offer_retailer.csv"), (brand_cats, "brand_category.csv"),
+                                        (processed, "processed_offers.csv")]]
+            for f in futures:
+                f.result()
+
+    stages = {
+        "read_offers": (read("offer_retailer.csv"), []),
+        "read_brand_categories": (read("brand_category.csv"), []),
+        "read_categories": (read("categories.csv"), []),
+        "fill_retailer": (fill_retailer, ["read_offers"]),
+        "offer_ids": (add_unique_ids_offers, ["fill_retailer"]),
+        "category_ids": (add_unique_ids_categories, ["read_brand_categories", "read_categories"]),
+        "group_offers": (lambda offers, brand_cats: group_offers(offers, brand_cats, workers, batch_size, cache_path),
+                         ["fill_retailer", "read_brand_categories"]),
+        "map_ids": (map_unique_ids, ["group_offers", "offer_ids"]),
+        "write": (write, ["offer_ids", "category_ids", "map_ids"]),
+        "snapshot": (lambda processed: snapshot(processed, path("offer_snapshot")), ["map_ids"]),
+    }
+
+    on_result = (lambda name, result: write_intermediate(intermediates_dir, name, result)) if intermediates_dir else None
+    _, timings = run_stages(stages, on_result=on_result)
+
+    for name, seconds in timings.items():
+        print(f"{name:24s} {seconds * 1000:10.1f} ms")
+
+    return timings
 
-    specific_offers_new = pd.DataFrame(new_offers)
-    processed_offers = pd.concat([specific_offers_new, generic_offers_new]).reset_index()
-    processed_offers.to_csv("../data/processed_offers.csv", index=False)
 
-  
 def main():
-    fill_retailer()
-    add_unique_ids_offers()
-    add_unique_ids_categories()
-    group_offers()
+    preprocess(workers=int(os.environ.get('PREPROCESS_WORKERS') or 1),
+               intermediates_dir=os.environ.get('PREPROCESS_INTERMEDIATES_DIR'))
 
 
 if __name__ == "__main__":
+    # run as `cd db && python data_preprocess.py`, the snapshot stage imports pinecone_model from the repository root
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
     main()
@@ -1,7 +1,33 @@
+import io
+import os
+import time
+from typing import List, Tuple
 import psycopg2
-from db.queries import create_schema, delete_tables, create_tables, insert_values
+from db.queries import (create_schema, delete_tables, create_tables, table_columns,
+                        primary_keys, copy_csv, create_staging, merge_upsert, merge_prune, merge_replace,
+                        delete_by_key, clear_table, refresh_views)
+from db.manifest import Manifest, hash_rows
 import pandas.io.sql as psql
 import pandas as pd
+from pinecone_model.categories import CategoryTree, parse_categories
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def to_pg_array(values) -> str:
+    """
+    Formats strings as a PostgreSQL array literal for COPY.
+
+    Args:
+        values: The strings.
+
+    Returns:
+        str: The array literal, e.g. {"Water","Juice"}.
+    """
+
+    escaped = ['"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values]
+    return "{" + ",".join(escaped) + "}"
+
 
 class DBDriver:
     """
@@ -66,62 +92,254 @@ class DBDriver:
         for c in create_tables:
             self.execute_query(c)
 
-        self.insert_from_csv('../data/categories.csv', 'coupons.categories')
-        self.insert_from_csv('../data/brand_category.csv', 'coupons.brand')
-        self.insert_from_csv('../data/offer_retailer.csv', 'coupons.offer')
+        self.load_all()
+
+
+    def reload(self) -> None:
+        """
+        Refreshes the tables from the CSV files through staging tables, without
+        dropping the existing tables.
+        """
+
+        self.execute_query(create_schema)
+
+        for c in create_tables:
+            self.execute_query(c)
+
+        self.load_all(merge=True)
+
+
+    def sync(self, manifest: Manifest = None) -> None:
+        """
+        Incrementally applies CSV changes recorded against the manifest: only new
+        or changed keyed rows are written and removed rows deleted. The brand table
+        has no key and is merged in full.
+
+        Args:
+            manifest (Manifest): The manifest of previously loaded rows.
+        """
+
+        manifest = manifest or Manifest()
+
+        self.execute_query(create_schema)
+
+        for c in create_tables:
+            self.execute_query(c)
+
+        self.sync_from_csv(os.path.join(DATA_DIR, 'categories.csv'), 'coupons.categories', manifest)
+        self.insert_from_csv(os.path.join(DATA_DIR, 'brand_category.csv'), 'coupons.brand', merge=True)
+        self.sync_from_csv(os.path.join(DATA_DIR, 'offer_retailer.csv'), 'coupons.offer', manifest)
+        self.load_categories()
+        self.execute_query(refresh_views)
+
+
+    def load_all(self, merge: bool = False) -> None:
+        """
+        Loads every CSV file into its table.
+
+        Args:
+            merge (bool): Whether to merge through a staging table instead of appending.
+        """
+
+        self.insert_from_csv(os.path.join(DATA_DIR, 'categories.csv'), 'coupons.categories', merge=merge)
+        self.insert_from_csv(os.path.join(DATA_DIR, 'brand_category.csv'), 'coupons.brand', merge=merge)
+        self.insert_from_csv(os.path.join(DATA_DIR, 'offer_retailer.csv'), 'coupons.offer', merge=merge)
+        self.load_categories()
+        self.execute_query(refresh_views)
+
+
+    def load_categories(self, categories_csv: str = os.path.join(DATA_DIR, 'categories.csv'),
+                        offers_csv: str = os.path.join(DATA_DIR, 'processed_offers.csv')) -> None:
+        """
+        Rebuilds the derived category tables in one transaction: each offer's
+        categories as a TEXT[] array, and the ancestor/descendant closure of the
+        category hierarchy.
+
+        Args:
+            categories_csv (str): The path to categories.csv.
+            offers_csv (str): The path to processed_offers.csv.
+        """
+
+        tree = CategoryTree(pd.read_csv(categories_csv))
+        closure = pd.DataFrame(tree.closure(), columns=["ancestor", "descendant", "depth"])
+
+        offers = pd.read_csv(offers_csv, usecols=["UNIQUE_ID", "CATEGORY"]).dropna(subset=["UNIQUE_ID"])
+        offers = offers.drop_duplicates(subset="UNIQUE_ID", keep="last")
+        offer_categories = pd.DataFrame({"offer_id": offers["UNIQUE_ID"],
+                                         "categories": [to_pg_array(parse_categories(c)) for c in offers["CATEGORY"]]})
+
+        try:
+            for table, rows in [("coupons.category_closure", closure), ("coupons.offer_categories", offer_categories)]:
+                self.curr.execute(clear_table.format(table=table))
+                self.copy_dataframe(rows, table, list(rows.columns))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
 
+        print(f"Loaded {len(closure)} category closure rows and {len(offer_categories)} offer category arrays")
 
-    def escape_single_quotes(self, text: str) -> str:
+
+    def read_table_csv(self, csv_file: str, table_name: str) -> pd.DataFrame:
         """
-        Escapes single quotes in a string to prevent SQL errors.
+        Reads the columns of a CSV file that belong to a table, dropping rows with
+        duplicate primary keys.
 
         Args:
-            text (str): The input string.
+            csv_file (str): The path to the CSV file.
+            table_name (str): The name of the target table.
 
         Returns:
-            str: The escaped string.
+            pd.DataFrame: The rows in table column order.
         """
-        
-        if isinstance(text, str):
-            return text.replace("'", "''")
-        return text
+
+        columns, csv_columns = table_columns[table_name]
+        dataframe = pd.read_csv(csv_file, usecols=csv_columns)[csv_columns]
+
+        key = primary_keys.get(table_name)
+        if key:
+            dataframe = dataframe.drop_duplicates(subset=csv_columns[columns.index(key)], keep="last")
+
+        return dataframe
 
 
-    def insert_from_csv(self, csv_file: str, table_name: str) -> None:
+    def copy_dataframe(self, dataframe: pd.DataFrame, table_name: str, columns: List[str]) -> None:
         """
-        Inserts data from a CSV file into a specified database table.
+        Streams rows into a table through COPY without committing.
+
+        Args:
+            dataframe (pd.DataFrame): The rows in column order.
+            table_name (str): The name of the target (or staging) table.
+            columns (List[str]): The table columns the rows are copied into.
+        """
+
+        buffer = io.StringIO()
+        dataframe.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        self.curr.copy_expert(copy_csv.format(table=table_name, columns=", ".join(columns)), buffer)
+
+
+    def insert_from_csv(self, csv_file: str, table_name: str, merge: bool = False) -> float:
+        """
+        Inserts data from a CSV file into a specified database table. The file is
+        streamed through PostgreSQL COPY in a single transaction. With `merge`, rows
+        are copied into a temporary staging table and merged into the target so
+        the table can be reloaded in place.
 
         Args:
             csv_file (str): The path to the CSV file.
             table_name (str): The name of the target table.
+            merge (bool): Whether to merge through a staging table instead of appending.
+
+        Returns:
+            float: The load throughput in rows per second.
 
         Raises:
             Exception: If the table name is unknown or insertion fails.
         """
 
-        dataframe = pd.read_csv(csv_file)
-
-        if table_name == 'coupons.categories':
-            insert_query = insert_values[0]
-        elif table_name == 'coupons.brand':
-            insert_query = insert_values[1]
-        elif table_name == 'coupons.offer':
-            insert_query = insert_values[2]
-        else:
+        if table_name not in table_columns:
             print(f"Unknown table: {table_name}")
-            return
+            return 0.0
 
-        for _, row in dataframe.iterrows():
-            print(row)
-            row = [self.escape_single_quotes(value) for value in row]
-            formatted_query = insert_query.format(*row)
-            self.execute_query(formatted_query)
+        start_time = time.time()
+        dataframe = self.read_table_csv(csv_file, table_name)
 
+        try:
+            if merge:
+                self._merge(dataframe, table_name, prune=True)
+            else:
+                self.copy_dataframe(dataframe, table_name, table_columns[table_name][0])
+
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        elapsed = time.time() - start_time
+        rows_per_sec = len(dataframe) / elapsed if elapsed > 0 else float("inf")
+        print(f"Loaded {len(dataframe)} rows into {table_name} in {elapsed:.2f}s ({rows_per_sec:.1f} rows/sec)")
+
+        return rows_per_sec
+
+
+    def sync_from_csv(self, csv_file: str, table_name: str, manifest: Manifest) -> Tuple[int, int]:
+        """
+        Applies only the rows of a keyed table that changed since the last sync,
+        using the content hashes recorded in the manifest.
 
-def main():
+        Args:
+            csv_file (str): The path to the CSV file.
+            table_name (str): The name of a table with a primary key.
+            manifest (Manifest): The manifest of previously loaded rows.
+
+        Returns:
+            Tuple[int, int]: The number of upserted and deleted rows.
+        """
+
+        columns, csv_columns = table_columns[table_name]
+        key = primary_keys[table_name]
+        key_column = csv_columns[columns.index(key)]
+
+        dataframe = self.read_table_csv(csv_file, table_name)
+        current = hash_rows(dataframe, key_column, csv_columns)
+        changed, removed = manifest.diff(f"db.{table_name}", current)
+        delta = dataframe[dataframe[key_column].astype(str).isin(set(changed))]
+
+        try:
+            if len(delta):
+                self._merge(delta, table_name, prune=False)
+            if removed:
+                self.curr.execute(delete_by_key.format(table=table_name, key=key), (removed,))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        manifest.update(f"db.{table_name}", current)
+        print(f"Synced {table_name}: {len(delta)} upserted, {len(removed)} deleted")
+
+        return len(delta), len(removed)
+
+
+    def _merge(self, dataframe: pd.DataFrame, table_name: str, prune: bool) -> None:
+        """
+        Copies rows into a temporary staging table and merges them into the target.
+
+        Args:
+            dataframe (pd.DataFrame): The rows in table column order.
+            table_name (str): The name of the target table.
+            prune (bool): Whether keyed rows missing from `dataframe` are deleted.
+        """
+
+        columns = table_columns[table_name][0]
+        column_list = ", ".join(columns)
+        key = primary_keys.get(table_name)
+        stage = "stage_" + table_name.split(".")[-1]
+
+        self.curr.execute(create_staging.format(stage=stage, table=table_name))
+        self.copy_dataframe(dataframe, stage, columns)
+
+        if key:
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != key)
+            self.curr.execute(merge_upsert.format(table=table_name, stage=stage, key=key,
+                                                  columns=column_list, updates=updates))
+            if prune:
+                self.curr.execute(merge_prune.format(table=table_name, stage=stage, key=key))
+        else:
+            self.curr.execute(merge_replace.format(table=table_name, stage=stage, columns=column_list))
+
+
+def main(reload: bool = False, incremental: bool = False):
     """
     The main function that initializes the DBDriver and sets up the database.
 
+    Args:
+        reload (bool): Whether to merge the CSV files into the existing tables
+            instead of recreating them.
+        incremental (bool): Whether to only apply rows changed since the last run.
+
     Returns:
         DBDriver: An instance of the DBDriver class.
     """
@@ -132,10 +350,16 @@ def main():
     password = "password"
     
     db = DBDriver(host=host, name=name, user=user, password=password)
-    db.setup()
+    if incremental:
+        db.sync()
+    elif reload:
+        db.reload()
+    else:
+        db.setup()
 
     return db
 
 
 if __name__ == "__main__":
-    main()
+    import sys
+    main(reload="--reload" in sys.argv, incremental="--incremental" in sys.argv)
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+import pandas as pd
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'manifest.json')
+
+
+def content_hash(values: Iterable) -> str:
+    """
+    Generates a SHA-256 hash of a row's values, used to detect changed rows.
+
+    Args:
+        values (Iterable): The row values.
+
+    Returns:
+        str: A hash string.
+    """
+
+    key = "\x1f".join("" if pd.isna(v) else str(v) for v in values)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def hash_rows(dataframe: pd.DataFrame, id_column: str, columns: List[str]) -> Dict[str, str]:
+    """
+    Hashes the given columns of every row, keyed by the row's ID.
+
+    Args:
+        dataframe (pd.DataFrame): The rows to hash.
+        id_column (str): The column holding the stable row ID.
+        columns (List[str]): The columns whose content is tracked.
+
+    Returns:
+        Dict[str, str]: The content hash of each ID.
+    """
+
+    return {str(id): content_hash(values)
+            for id, values in zip(dataframe[id_column], dataframe[columns].itertuples(index=False))}
+
+
+class Manifest:
+    """
+    Records the content hash of every row each pipeline stage has processed, so
+    later runs only handle new, changed and removed rows.
+
+    Attributes:
+        path (str): The JSON file the manifest is stored in.
+        stages (Dict[str, Dict[str, str]]): The processed ID hashes of each stage.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH) -> None:
+        """
+        Loads the manifest if it exists.
+
+        Args:
+            path (str): The JSON file the manifest is stored in.
+        """
+
+        self.path = path
+        self.stages = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.stages = json.load(f).get("stages", {})
+
+
+    def diff(self, stage: str, current: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """
+        Compares the current rows against what a stage last processed.
+
+        Args:
+            stage (str): The pipeline stage, e.g. "db.offer" or "index".
+            current (Dict[str, str]): The current content hash of each ID.
+
+        Returns:
+            Tuple[List[str], List[str]]: The new or changed IDs, and the removed IDs.
+        """
+
+        previous = self.stages.get(stage, {})
+        changed = [id for id, h in current.items() if previous.get(id) != h]
+        removed = [id for id in previous if id not in current]
+
+        return changed, removed
+
+
+    def update(self, stage: str, current: Dict[str, str]) -> None:
+        """
+        Records that a stage has processed the current rows and saves the manifest.
+
+        Args:
+            stage (str): The pipeline stage.
+            current (Dict[str, str]): The current content hash of each ID.
+        """
+
+        self.stages[stage] = dict(current)
+        self.save()
+
+
+    def save(self) -> None:
+        """
+        Writes the manifest with an atomic rename.
+        """
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"stages": self.stages}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from db.queries import prepared_statements, relation_exists
+
+pool_params = {"minconn": int(os.environ.get('DB_POOL_MINCONN') or 1),
+               "maxconn": int(os.environ.get('DB_POOL_MAXCONN') or 10),
+               # seconds a connection may sit idle before its next checkout is health-checked
+               "idle_check": float(os.environ.get('DB_POOL_IDLE_CHECK') or 30)}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PreparedConnectionPool(ThreadedConnectionPool):
+    """
+    A thread-safe connection pool whose connections run in autocommit mode and
+    have the statements in `db.queries.prepared_statements` prepared once, when
+    the connection is opened, so their plans are reused by every lookup. A
+    statement whose relation does not exist yet is prepared on a later checkout.
+
+    `ThreadedConnectionPool.getconn` raises `PoolError` once `maxconn`
+    connections are checked out, so `slots` counts the free connections and
+    `connection` waits on it instead.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs) -> None:
+        self.slots = threading.BoundedSemaphore(maxconn)
+        # keyed by id(conn); reset whenever a connection is opened
+        self.prepared = {}
+        self.returned_at = {}
+        # when connections missing a statement last looked for its relation
+        self.prepare_checked_at = 0.0
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None) -> psycopg2.extensions.connection:
+        conn = super()._connect(key)
+        conn.autocommit = True
+        self.prepared[id(conn)] = set()
+        self.returned_at.pop(id(conn), None)
+        self.prepare(conn)
+        return conn
+
+    def prepare(self, conn: psycopg2.extensions.connection) -> None:
+        """
+        Prepares the statements not yet prepared on a connection whose relations exist.
+        """
+
+        done = self.prepared.setdefault(id(conn), set())
+        self.prepare_checked_at = time.monotonic()
+        with conn.cursor() as curr:
+            for name, (relation, statement) in prepared_statements.items():
+                if name in done:
+                    continue
+                curr.execute(relation_exists, (relation,))
+                if curr.fetchone()[0]:
+                    curr.execute(statement)
+                    done.add(name)
+
+
+def get_pool(host: str, name: str, user: str, password: str,
+             minconn: Optional[int] = None, maxconn: Optional[int] = None) -> PreparedConnectionPool:
+    """
+    Returns the process-wide connection pool, creating it on first use.
+
+    Args:
+        host (str): The database host.
+        name (str): The database name.
+        user (str): The username for authentication.
+        password (str): The password for authentication.
+        minconn (int): The number of connections opened up front, DB_POOL_MINCONN by default.
+        maxconn (int): The maximum number of open connections, DB_POOL_MAXCONN by default.
+
+    Returns:
+        PreparedConnectionPool: The shared pool.
+    """
+
+    global _pool
+
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                _pool = PreparedConnectionPool(minconn or pool_params["minconn"], maxconn or pool_params["maxconn"],
+                                               f"host={host} dbname={name} user={user} password={password}")
+
+    return _pool
+
+
+def _is_healthy(conn: psycopg2.extensions.connection) -> bool:
+    """
+    Checks that a pooled connection is still usable.
+    """
+
+    if conn.closed:
+        return False
+
+    try:
+        with conn.cursor() as curr:
+            curr.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def connection(host: str, name: str, user: str, password: str,
+               pool: Optional[PreparedConnectionPool] = None) -> Iterator[psycopg2.extensions.connection]:
+    """
+    Borrows a connection from the pool and returns it afterwards, waiting while
+    all `maxconn` connections are in use. To save a round trip per query, a
+    connection is only health-checked when it was idle for longer than
+    `idle_check` seconds, or after the caller's queries failed; broken
+    connections are discarded.
+
+    Args:
+        host (str): The database host.
+        name (str): The database name.
+        user (str): The username for authentication.
+        password (str): The password for authentication.
+        pool (PreparedConnectionPool): The pool to use, defaults to the shared pool.
+
+    Yields:
+        psycopg2.extensions.connection: A pooled connection.
+    """
+
+    pool = pool or get_pool(host, name, user, password)
+
+    pool.slots.acquire()
+    try:
+        # at most maxconn idle connections can be broken, after which getconn opens a new one
+        for _ in range(pool.maxconn + 1):
+            conn = pool.getconn()
+            idle = time.monotonic() - pool.returned_at.get(id(conn), time.monotonic())
+            if not conn.closed and (idle <= pool_params["idle_check"] or _is_healthy(conn)):
+                break
+            pool.putconn(conn, close=True)
+        else:
+            raise psycopg2.OperationalError("no healthy database connection could be opened")
+
+        broken = False
+        try:
+            # a database without a statement's relation is rechecked at most every idle_check seconds
+            if (len(pool.prepared.get(id(conn), ())) < len(prepared_statements) and
+                    time.monotonic() - pool.prepare_checked_at > pool_params["idle_check"]):
+                pool.prepare(conn)
+            yield conn
+        except Exception:
+            broken = not _is_healthy(conn)
+            raise
+        finally:
+            pool.returned_at[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=broken or bool(conn.closed))
+    finally:
+        pool.slots.release()
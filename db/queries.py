@@ -1,8 +1,11 @@
 create_schema = """CREATE SCHEMA IF NOT EXISTS coupons;"""
 
-delete_tables = ["DROP TABLE IF EXISTS coupons.categories;",
-                 "DROP TABLE IF EXISTS coupons.brand;"
-                 "DROP TABLE IF EXISTS coupons.offer;"]
+delete_tables = ["DROP MATERIALIZED VIEW IF EXISTS coupons.offer_enriched;",
+                 "DROP TABLE IF EXISTS coupons.categories;",
+                 "DROP TABLE IF EXISTS coupons.brand;",
+                 "DROP TABLE IF EXISTS coupons.offer;",
+                 "DROP TABLE IF EXISTS coupons.offer_categories;",
+                 "DROP TABLE IF EXISTS coupons.category_closure;"]
 
 create_tables = [
 """
@@ -26,10 +29,103 @@ CREATE TABLE IF NOT EXISTS coupons.offer (
     brand VARCHAR(1000),
     offer_id VARCHAR(1000) PRIMARY KEY
 );
+""",
+"""
+CREATE TABLE IF NOT EXISTS coupons.offer_categories (
+	offer_id VARCHAR(1000) PRIMARY KEY,
+	categories TEXT[] NOT NULL
+);
+CREATE INDEX IF NOT EXISTS offer_categories_gin ON coupons.offer_categories USING GIN (categories);
+""",
+"""
+CREATE TABLE IF NOT EXISTS coupons.category_closure (
+	ancestor VARCHAR(1000),
+	descendant VARCHAR(1000),
+	depth INTEGER,
+	PRIMARY KEY (ancestor, descendant)
+);
+CREATE INDEX IF NOT EXISTS category_closure_descendant ON coupons.category_closure (descendant);
+""",
+"""
+CREATE INDEX IF NOT EXISTS brand_brand ON coupons.brand (brand);
+CREATE INDEX IF NOT EXISTS brand_category_id ON coupons.brand (category_id);
+CREATE INDEX IF NOT EXISTS offer_brand ON coupons.offer (brand);
+CREATE INDEX IF NOT EXISTS offer_retailer ON coupons.offer (retailer);
+""",
+"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS coupons.offer_enriched AS
+SELECT o.offer_id, o.offer, o.retailer, o.brand,
+	COALESCE(oc.categories, '{}') AS categories,
+	COALESCE(array_agg(DISTINCT b.brand_category) FILTER (WHERE b.brand_category IS NOT NULL), '{}') AS brand_categories,
+	COALESCE(array_agg(DISTINCT c.is_child_category_to) FILTER (WHERE c.is_child_category_to IS NOT NULL), '{}') AS parent_categories
+FROM coupons.offer o
+LEFT JOIN coupons.offer_categories oc ON oc.offer_id = o.offer_id
+LEFT JOIN coupons.brand b ON b.brand = o.brand
+LEFT JOIN coupons.categories c ON c.category_id = b.category_id
+GROUP BY o.offer_id, o.offer, o.retailer, o.brand, oc.categories;
+CREATE UNIQUE INDEX IF NOT EXISTS offer_enriched_offer_id ON coupons.offer_enriched (offer_id);
 """]
 
-insert_values = [
-"INSERT INTO coupons.categories VALUES ('{}', '{}', '{}');",
-"INSERT INTO coupons.brand VALUES ('{}', '{}', '{}');",
-"INSERT INTO coupons.offer VALUES ('{}', '{}', '{}', '{}');"
-]
+# The unique index on offer_id lets the view be refreshed without blocking readers
+refresh_views = "REFRESH MATERIALIZED VIEW CONCURRENTLY coupons.offer_enriched;"
+
+# CSV columns loaded into each table, in table column order
+table_columns = {
+    "coupons.categories": (["category_id", "product_category", "is_child_category_to"],
+                           ["CATEGORY_ID", "PRODUCT_CATEGORY", "IS_CHILD_CATEGORY_TO"]),
+    "coupons.brand": (["brand", "brand_category", "category_id"],
+                      ["BRAND", "BRAND_BELONGS_TO_CATEGORY", "CATEGORY_ID"]),
+    "coupons.offer": (["offer", "retailer", "brand", "offer_id"],
+                      ["OFFER", "RETAILER", "BRAND", "UNIQUE_ID"])
+}
+
+primary_keys = {"coupons.categories": "category_id",
+                "coupons.offer": "offer_id"}
+
+copy_csv = "COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+create_staging = "CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;"
+
+# Tables with a primary key are upserted from the staging table
+merge_upsert = """
+INSERT INTO {table} ({columns})
+SELECT DISTINCT ON ({key}) {columns} FROM {stage}
+ON CONFLICT ({key}) DO UPDATE SET {updates};
+"""
+
+# On a full reload, rows missing from the CSV are removed
+merge_prune = "DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM {stage} s WHERE s.{key} = t.{key});"
+
+delete_by_key = "DELETE FROM {table} WHERE {key} = ANY(%s);"
+
+clear_table = "DELETE FROM {table};"
+
+# Every offer in a category or any category below it, through the closure table and GIN index
+offers_under_category = """
+SELECT o.* FROM coupons.offer o
+JOIN coupons.offer_categories oc ON oc.offer_id = o.offer_id
+WHERE oc.categories && ARRAY(SELECT descendant::TEXT FROM coupons.category_closure WHERE ancestor = %s);
+"""
+
+# Tables without a key are swapped in a single transaction
+merge_replace = """
+DELETE FROM {table};
+INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage};
+"""
+
+# Brand and retailer names indexed by the BM25 index
+offer_brands = "SELECT offer_id AS \"UNIQUE_ID\", retailer AS \"RETAILER\", brand AS \"BRAND\" FROM coupons.offer;"
+
+# Prepared once per pooled connection in db/pool.py, keyed by name with the
+# relation each one reads, so databases without that relation skip it
+prepared_statements = {
+"enriched_lookup": ("coupons.offer_enriched",
+"""PREPARE enriched_lookup (text[]) AS
+SELECT offer_id, offer, retailer, brand, categories, brand_categories, parent_categories
+FROM coupons.offer_enriched WHERE offer_id = ANY($1)
+ORDER BY array_position($1, offer_id::TEXT);""")
+}
+
+relation_exists = "SELECT to_regclass(%s) IS NOT NULL;"
+
+execute_enriched_lookup = "EXECUTE enriched_lookup (%s);"
@@ -0,0 +1,190 @@
+# Bounded in-memory caches with optional on-disk persistence
+
+import atexit
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def normalize_query(q: str) -> str:
+	"""
+	Normalizes query text so trivially different spellings share a cache entry.
+
+	Args:
+		q (str): The query text.
+
+	Returns:
+		str: The lowercased query with collapsed whitespace.
+	"""
+
+	return " ".join(q.lower().split())
+
+
+class LRUCache():
+	"""
+	A thread-safe least-recently-used cache with optional expiry.
+
+	Attributes:
+		maxsize (int): The maximum number of entries before the oldest is evicted.
+		ttl (float): An optional lifetime of entries in seconds.
+		path (str): An optional pickle file the cache is loaded from and saved to.
+		hits (int): The number of successful lookups.
+		misses (int): The number of failed lookups.
+	"""
+
+	def __init__(self, maxsize: int = 1024, path: Optional[str] = None, save_every: int = 32,
+				 ttl: Optional[float] = None) -> None:
+		"""
+		Initializes the cache, loading previously persisted entries from `path`.
+
+		Args:
+			maxsize (int): The maximum number of entries.
+			path (str): An optional pickle file used for persistence.
+			save_every (int): The number of insertions between saves to `path`.
+			ttl (float): An optional lifetime of entries in seconds.
+		"""
+
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.path = path
+		self.save_every = save_every
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+		self._unsaved = 0
+		self._lock = threading.Lock()
+
+		if path:
+			self.load()
+			atexit.register(self.flush)
+
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		"""
+		Looks up a key and marks it as recently used.
+		"""
+
+		with self._lock:
+			if key in self._data:
+				stored_at, value = self._data[key]
+				if self._expired(stored_at):
+					del self._data[key]
+				else:
+					self._data.move_to_end(key)
+					self.hits += 1
+					return value
+
+			self.misses += 1
+			return default
+
+
+	def _expired(self, stored_at: float) -> bool:
+		return self.ttl is not None and time.time() - stored_at > self.ttl
+
+
+	def put(self, key: Hashable, value: Any) -> None:
+		"""
+		Inserts a value, evicting the least recently used entry when full.
+		"""
+
+		with self._lock:
+			self._data[key] = (time.time(), value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+			self._unsaved += 1
+			save = self.path and self._unsaved >= self.save_every
+
+		if save:
+			self.flush()
+
+
+	def __contains__(self, key: Hashable) -> bool:
+		return key in self._data
+
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+			self.hits = self.misses = 0
+
+
+	def stats(self) -> Dict:
+		"""
+		Returns:
+			Dict: The size, hit and miss counters and hit rate of the cache.
+		"""
+
+		total = self.hits + self.misses
+		return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+				"misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+	def save(self) -> None:
+		"""
+		Persists the cache to `path` with an atomic rename. Every save writes its
+		own temporary file, so processes sharing `path` never rename each other's.
+		"""
+
+		if not self.path:
+			return
+
+		with self._lock:
+			items = list(self._data.items())
+			self._unsaved = 0
+
+		directory = os.path.dirname(os.path.abspath(self.path))
+		os.makedirs(directory, exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as f:
+				pickle.dump(items, f)
+			os.replace(tmp, self.path)
+		except BaseException:
+			os.remove(tmp)
+			raise
+
+
+	def flush(self) -> None:
+		"""
+		Saves the cache, reporting rather than raising errors: persistence is
+		best effort and must not fail the request that triggered it.
+		"""
+
+		try:
+			self.save()
+		except (OSError, pickle.PicklingError) as e:
+			print(f"Could not save cache to {self.path}: {e}")
+
+
+	def load(self) -> None:
+		"""
+		Loads entries persisted by a previous process, ignoring unreadable files.
+		"""
+
+		if not self.path or not os.path.exists(self.path):
+			return
+
+		try:
+			with open(self.path, "rb") as f:
+				items = pickle.load(f)
+		except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, ImportError):
+			# missing, truncated, or pickled from classes that no longer exist
+			return
+
+		if not isinstance(items, list) or not all(isinstance(item, tuple) and len(item) == 2 and
+												  isinstance(item[1], tuple) and len(item[1]) == 2 for item in items):
+			return
+
+		with self._lock:
+			for key, (stored_at, value) in items[-self.maxsize:]:
+				if not self._expired(stored_at):
+					self._data[key] = (stored_at, value)
@@ -0,0 +1,150 @@
+# Product category hierarchy from categories.csv
+
+import ast
+import os
+import sys
+import threading
+from typing import Iterator, List, Tuple
+import pandas as pd
+
+categories_path = os.environ.get('CATEGORIES_PATH') or os.path.join(os.path.dirname(__file__), '..', 'data', 'categories.csv')
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def parse_categories(categories: str) -> Tuple[str, ...]:
+	"""
+	Parses the stringified category set stored in `processed_offers.csv`.
+
+	Args:
+		categories (str): A category set such as "{'Water', 'Juice'}".
+
+	Returns:
+		Tuple[str, ...]: The sorted, interned category names.
+	"""
+
+	if not categories:
+		return ()
+
+	try:
+		parsed = ast.literal_eval(categories)
+	except (ValueError, SyntaxError):
+		parsed = categories.replace("{", "").replace("}", "").split(", ")
+
+	return tuple(sorted(sys.intern(str(c).strip()) for c in parsed))
+
+
+class CategoryTree():
+	"""
+	The parent/child relations of product categories, where a category's parent
+	is given by its IS_CHILD_CATEGORY_TO column.
+
+	Attributes:
+		children (Dict[str, List[str]]): The direct children of each category.
+		parents (Dict[str, str]): The parent of each category that has one.
+		names (Dict[str, str]): The stored name of each lowercased category name.
+	"""
+
+	def __init__(self, categories: pd.DataFrame) -> None:
+		"""
+		Args:
+			categories (pd.DataFrame): The rows of categories.csv.
+		"""
+
+		self.children = {}
+		self.parents = {}
+		for child, parent in zip(categories["PRODUCT_CATEGORY"], categories["IS_CHILD_CATEGORY_TO"]):
+			if isinstance(parent, str) and parent != child:
+				self.children.setdefault(parent, []).append(child)
+				self.parents[child] = parent
+		self.names = {c.lower(): c for c in categories["PRODUCT_CATEGORY"] if isinstance(c, str)}
+		self.names.update({c.lower(): c for c in self.categories()})
+
+	def categories(self) -> List[str]:
+		"""
+		Returns:
+			List[str]: Every category that appears as a parent or a child.
+		"""
+
+		return list(dict.fromkeys(list(self.children) + list(self.parents)))
+
+	def resolve(self, category: str) -> str:
+		"""
+		Returns:
+			str: The stored spelling of a category name given in any case, or the name itself if unknown.
+		"""
+
+		return self.names.get(category.lower(), category)
+
+	def descendants(self, category: str) -> List[str]:
+		"""
+		Returns a category followed by every category below it. The category is
+		matched case-insensitively.
+
+		Args:
+			category (str): The category name.
+
+		Returns:
+			List[str]: The category and its descendants.
+		"""
+
+		category = self.resolve(category)
+		found = [category]
+		seen = {category}
+		for c in found:
+			for child in self.children.get(c, []):
+				if child not in seen:
+					seen.add(child)
+					found.append(child)
+
+		return found
+
+	def ancestors(self, category: str) -> List[str]:
+		"""
+		Returns the categories above a category, nearest first.
+
+		Args:
+			category (str): The category name.
+
+		Returns:
+			List[str]: The parent, grandparent and so on up to the root.
+		"""
+
+		found = []
+		c = self.parents.get(category)
+		while c is not None and c != category and c not in found:
+			found.append(c)
+			c = self.parents.get(c)
+
+		return found
+
+	def closure(self) -> Iterator[Tuple[str, str, int]]:
+		"""
+		Yields the transitive closure of the hierarchy, including each category
+		paired with itself at depth 0, so "everything under X" is one lookup.
+
+		Yields:
+			Tuple[str, str, int]: The ancestor, the descendant and their distance.
+		"""
+
+		for category in self.categories():
+			yield category, category, 0
+			for depth, ancestor in enumerate(self.ancestors(category), start=1):
+				yield ancestor, category, depth
+
+
+def get_tree() -> CategoryTree:
+	"""
+	Returns:
+		CategoryTree: The shared category tree, loaded from `categories_path` on first use.
+	"""
+
+	global _tree
+
+	if _tree is None:
+		with _tree_lock:
+			if _tree is None:
+				_tree = CategoryTree(pd.read_csv(categories_path))
+
+	return _tree
@@ -0,0 +1,121 @@
+# Near-duplicate offer clustering with MinHash and locality-sensitive hashing
+
+import hashlib
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Hashes are taken modulo this Mersenne prime so a * x + b stays within 64 bits
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, n: int = 3) -> set:
+	"""
+	Args:
+		text (str): The offer text.
+		n (int): The number of words per shingle.
+
+	Returns:
+		set: The word n-grams of the lowercased text, or the text itself when shorter.
+	"""
+
+	words = re.findall(r"\w+", text.lower())
+	if len(words) <= n:
+		return {" ".join(words)}
+
+	return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def minhash_signatures(texts: List[str], num_perm: int = 64, seed: int = 0) -> np.ndarray:
+	"""
+	Computes a MinHash signature per text. The fraction of equal signature
+	entries of two texts estimates the Jaccard similarity of their shingles.
+
+	Args:
+		texts (List[str]): The offer texts.
+		num_perm (int): The number of hash functions.
+		seed (int): The seed of the hash functions.
+
+	Returns:
+		np.ndarray: The signatures, one row per text.
+	"""
+
+	rng = np.random.default_rng(seed)
+	a = rng.integers(1, _PRIME, num_perm, dtype=np.int64)
+	b = rng.integers(0, _PRIME, num_perm, dtype=np.int64)
+
+	signatures = np.empty((len(texts), num_perm), dtype=np.int64)
+	for i, text in enumerate(texts):
+		hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") & _PRIME
+						   for s in shingles(text)], dtype=np.int64)
+		signatures[i] = ((np.outer(hashes, a) + b) % _PRIME).min(axis=0)
+
+	return signatures
+
+
+def cluster(texts: List[str], threshold: float = 0.8, num_perm: int = 64, bands: int = 16) -> List[int]:
+	"""
+	Groups texts whose estimated Jaccard similarity reaches `threshold`. Candidate
+	pairs come from signature bands that hash to the same bucket, and the
+	clusters are the connected components of the verified pairs.
+
+	Args:
+		texts (List[str]): The offer texts.
+		threshold (float): The minimum estimated Jaccard similarity of duplicates.
+		num_perm (int): The number of hash functions.
+		bands (int): The number of LSH bands; num_perm must be divisible by it.
+
+	Returns:
+		List[int]: The position of each text's cluster representative, the first text of the cluster.
+	"""
+
+	signatures = minhash_signatures(texts, num_perm)
+	rows = num_perm // bands
+	parent = list(range(len(texts)))
+
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	for band in range(bands):
+		buckets = {}
+		for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+			buckets.setdefault(key, []).append(i)
+
+		for members in buckets.values():
+			first = members[0]
+			for j in members[1:]:
+				ri, rj = find(first), find(j)
+				if ri != rj and np.mean(signatures[first] == signatures[j]) >= threshold:
+					# the earlier text stays the representative
+					parent[max(ri, rj)] = min(ri, rj)
+
+	return [find(i) for i in range(len(texts))]
+
+
+def collapse(parsed_data: List[List[str]], threshold: float = 0.8) -> Tuple[List[List[str]], Dict[str, List[str]]]:
+	"""
+	Keeps one row per cluster of near-duplicate offers.
+
+	Args:
+		parsed_data (List[List[str]]): The rows returned by indexer.parse_data.
+		threshold (float): The minimum estimated Jaccard similarity of duplicates.
+
+	Returns:
+		The representative rows, and the IDs of the other members of each
+		representative that has any.
+	"""
+
+	representatives = cluster([d[1] for d in parsed_data], threshold)
+
+	members = {}
+	for d, rep in zip(parsed_data, representatives):
+		rep_id = parsed_data[rep][3]
+		if d[3] != rep_id:
+			members.setdefault(rep_id, []).append(d[3])
+
+	kept = [d for i, (d, rep) in enumerate(zip(parsed_data, representatives)) if i == rep]
+	return kept, {id: list(dict.fromkeys(ids)) for id, ids in members.items()}
@@ -1,23 +1,42 @@
-# Manages vector indexing in Pinecone
+# Manages vector indexing in Pinecone or the local index
 
-from pinecone import Pinecone
-from pinecone import ServerlessSpec
+import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from . import utils
+from .categories import parse_categories
+from .dedup import collapse
 import json
 import pandas as pd
 
+# Marks the end of a stream between pipeline stages
+_DONE = object()
+
 class PineCone():
-	def __init__(self, index_name: str) -> None:
+	def __init__(self, index_name: str, backend: str = None) -> None:
 		"""
 		Initializes the Pinecone client and creates an index if it doesn't exist.
+		With the "local" backend the index is an in-process LocalIndex instead.
 
 		Args:
 			index_name: The specific index used.
+			backend: "pinecone" or "local", defaults to utils.backend.
 
 		Returns:
 			The Pinecone index.
 		"""
+
+		backend = backend or utils.backend
+		if backend != "pinecone":
+			self.index = connect_to_db(index_name, backend=backend)
+			# buffer the chunks and persist once in index_data rather than after every chunk
+			self.index.autosave = False
+			return
+
+		from pinecone import Pinecone, ServerlessSpec
+
 		pc = Pinecone(api_key=utils.api_key,
 					  similarity_metric=utils.params["sim_mets"][0],
 					  search_algorithm=utils.params["search_algo"][0])
@@ -40,90 +59,455 @@ class PineCone():
 		self.index = pc.Index(index_name, algorithm=utils.params["index_algo"][0])
 
 
-	def create_embeddings(self, test_data):
+	def create_embeddings(self, test_data, batch_size: int = None, members=None):
 		"""
-		Creates embeddings for the test data using the embedding model.
+		Creates embeddings for the test data using the embedding model. Offers are
+		encoded in batches of `batch_size` rather than one model call per row.
 
 		Args:
 			test_data: The test data to create embeddings for.
+			batch_size: The number of offers per model call.
+			members: The collapsed duplicates of each representative offer.
 
 		Returns:
 			The test data with embeddings added.
 		"""
 
-		data = []
-		for d in test_data:
-			d[0] = d[3]
-			d[1] = utils.embedding_model.encode(d[1]).tolist()
-			d[2] = {"Categories": d[2]}
-			d = tuple(tuple(d[:-1]))
-			data.append(d)
+		batch_size = batch_size or utils.indexing_params["batch_size"]
+		vectors = utils.get_embedding_model().encode([d[1] for d in test_data], batch_size=batch_size)
 
-		# for d in data:
-		# 	print(d)
-		# 	print(len(d))
+		data = []
+		for d, vector in zip(test_data, vectors):
+			data.append((d[3], vector.tolist(), build_metadata(d, (members or {}).get(d[3]))))
 
 		return data
 
-	def upsert_embeddings(self, embeddings):
+	def index_data(self, parsed_data, batch_size: int = None, chunk_size: int = None, workers: int = None,
+				   dedup: bool = None, members: dict = None) -> float:
+		"""
+		Embeds and upserts the parsed data. Each encoded batch is handed to the
+		upsert pool straight away, so uploading overlaps with encoding the next batch.
+
+		With dedup, near-duplicate offers are collapsed first: only the first offer
+		of each cluster is embedded and indexed, with the other IDs stored in its
+		"Members" metadata, and vectors left from earlier runs for those IDs are deleted.
+
+		Args:
+			parsed_data: The rows returned by parse_data.
+			batch_size: The number of offers per model call.
+			chunk_size: The number of vectors per upsert request.
+			workers: The number of concurrent upsert requests.
+			dedup: Whether to collapse near-duplicates, defaults to utils.indexing_params["dedup"].
+			members: The collapsed duplicates of each row, when the rows are already collapsed.
+
+		Returns:
+			float: The indexing throughput in rows per second.
+		"""
+
+		batch_size = batch_size or utils.indexing_params["batch_size"]
+		chunk_size = chunk_size or utils.indexing_params["chunk_size"]
+		workers = workers or utils.indexing_params["workers"]
+		dedup = dedup if dedup is not None else utils.indexing_params["dedup"]
+
+		start_time = time.time()
+		futures = []
+		rows, members = parsed_data, members or {}
+		if dedup:
+			rows, members = collapse(parsed_data, utils.indexing_params["dedup_threshold"])
+			print(f"Collapsed {len(parsed_data)} offers into {len(rows)} clusters")
+
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			for i in range(0, len(rows), chunk_size):
+				embeddings = self.create_embeddings(rows[i:i + chunk_size], batch_size=batch_size, members=members)
+				futures.append(pool.submit(self.index.upsert, embeddings))
+
+			duplicates = [id for ids in members.values() for id in ids]
+			for i in range(0, len(duplicates), chunk_size):
+				futures.append(pool.submit(self.index.delete, ids=duplicates[i:i + chunk_size]))
+
+			for f in futures:
+				f.result()
+
+		if hasattr(self.index, "save"):
+			self.index.save()
+
+		elapsed = time.time() - start_time
+		rows_per_sec = len(parsed_data) / elapsed if elapsed > 0 else float("inf")
+		print(f"Indexed {len(parsed_data)} rows in {elapsed:.2f}s ({rows_per_sec:.1f} rows/sec)")
+
+		return rows_per_sec
+
+	def index_stream(self, path: str, offers: pd.DataFrame = None, batch_size: int = None, chunk_size: int = None,
+					 workers: int = None, queue_size: int = None, checkpoint_path: str = None, checkpoint: bool = True,
+					 resume: bool = True) -> float:
+		"""
+		Indexes a processed offers CSV without loading it whole. A reader thread
+		parses it chunk by chunk, an encoder thread embeds each chunk and `workers`
+		threads upsert them. The stages are connected by queues holding at most
+		`queue_size` chunks, so memory stays flat whatever the file size.
+
+		Every `checkpoint_every` chunks, the number of rows whose upserts (and all
+		earlier ones) finished is saved to `checkpoint_path`, after saving the
+		index when it supports it. After a failure, the next run with the same,
+		unmodified file resumes from that row. The checkpoint is removed once the file is done.
+		A local index merges its buffered upserts and writes a new version at every
+		checkpoint, so raising `checkpoint_every` trades resume granularity for
+		fewer rewrites of the index.
+
+		Args:
+			path (str): The processed offers CSV.
+			offers (pd.DataFrame): The offer_retailer rows holding each offer's retailer and brand.
+			batch_size (int): The number of offers per model call.
+			chunk_size (int): The number of rows per chunk and upsert request.
+			workers (int): The number of concurrent upsert requests.
+			queue_size (int): The number of chunks buffered between stages.
+			checkpoint_path (str): The JSON file holding the resume offset.
+			checkpoint (bool): Whether to write checkpoints.
+			resume (bool): Whether to continue from an existing checkpoint.
+
+		Returns:
+			float: The indexing throughput in rows per second.
 		"""
-		Upserts embeddings into the vector db.
+
+		batch_size = batch_size or utils.indexing_params["batch_size"]
+		chunk_size = chunk_size or utils.indexing_params["chunk_size"]
+		workers = workers or utils.indexing_params["workers"]
+		queue_size = queue_size or utils.indexing_params["queue_size"]
+		checkpoint_every = utils.indexing_params["checkpoint_every"]
+		checkpoint_path = (checkpoint_path or utils.indexing_params["checkpoint_path"]) if checkpoint else None
+
+		# taken before reading, so a file rewritten mid-run does not match the checkpoint
+		version = source_version(path)
+		start = read_checkpoint(checkpoint_path, path) if resume and checkpoint_path else 0
+		if start:
+			print(f"Resuming {path} from row {start}")
+
+		parsed = queue.Queue(maxsize=queue_size)
+		encoded = queue.Queue(maxsize=queue_size)
+		stop = threading.Event()
+		errors = []
+		lock = threading.Lock()
+		progress = {"done": {}, "next": 0, "offset": start, "since_checkpoint": 0}
+
+		def put(q, item):
+			while not stop.is_set():
+				try:
+					q.put(item, timeout=0.1)
+					return True
+				except queue.Full:
+					continue
+			return False
+
+		def get(q):
+			while not stop.is_set():
+				try:
+					return q.get(timeout=0.1)
+				except queue.Empty:
+					continue
+			return _DONE
+
+		def run(stage):
+			def wrapper(*args):
+				try:
+					stage(*args)
+				except BaseException as e:
+					errors.append(e)
+					stop.set()
+			return wrapper
+
+		def read():
+			for seq, (end, rows) in enumerate(read_chunks(path, offers, chunk_size, start)):
+				if not put(parsed, (seq, end, rows)):
+					return
+			put(parsed, _DONE)
+
+		def encode():
+			while True:
+				item = get(parsed)
+				if item is _DONE:
+					break
+				seq, end, rows = item
+				if not put(encoded, (seq, end, len(rows), self.create_embeddings(rows, batch_size=batch_size))):
+					return
+			for _ in range(workers):
+				put(encoded, _DONE)
+
+		def upsert():
+			while True:
+				item = get(encoded)
+				if item is _DONE:
+					return
+				seq, end, count, embeddings = item
+				self.index.upsert(embeddings)
+
+				with lock:
+					# the checkpoint only moves past chunks whose predecessors are all upserted
+					progress["done"][seq] = (end, count)
+					while progress["next"] in progress["done"]:
+						progress["offset"], _ = progress["done"].pop(progress["next"])
+						progress["next"] += 1
+						progress["since_checkpoint"] += 1
+					if checkpoint_path and progress["since_checkpoint"] >= checkpoint_every:
+						progress["since_checkpoint"] = 0
+						if hasattr(self.index, "save"):
+							self.index.save()
+						write_checkpoint(checkpoint_path, version, progress["offset"])
+
+		start_time = time.time()
+		threads = [threading.Thread(target=run(read)), threading.Thread(target=run(encode))]
+		threads += [threading.Thread(target=run(upsert)) for _ in range(workers)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		if errors:
+			if checkpoint_path:
+				print(f"Indexing failed; rerun to resume from row {progress['offset']}")
+			raise errors[0]
+
+		if hasattr(self.index, "save"):
+			self.index.save()
+		if checkpoint_path and os.path.exists(checkpoint_path):
+			os.remove(checkpoint_path)
+
+		rows = progress["offset"] - start
+		elapsed = time.time() - start_time
+		rows_per_sec = rows / elapsed if elapsed > 0 else float("inf")
+		print(f"Streamed {rows} rows in {elapsed:.2f}s ({rows_per_sec:.1f} rows/sec)")
+
+		return rows_per_sec
+
+	def sync_data(self, data: pd.DataFrame, manifest=None, offers: pd.DataFrame = None, **kwargs):
 		"""
+		Incrementally indexes processed offers: only offers whose text, categories,
+		retailer or brand changed since the last sync are embedded and upserted,
+		and vectors of offers that disappeared are deleted.
+
+		With dedup, any offer can join or leave a cluster, so every offer is
+		regrouped and the manifest tracks each representative with its members.
+		Only representatives whose offer or members changed are embedded, and
+		offers that stopped being representatives are deleted like removed ones.
+
+		Args:
+			data: The processed offers.
+			manifest: The db.manifest.Manifest of previously indexed offers.
+			offers: The offer_retailer rows holding each offer's retailer and brand.
+			**kwargs: Batch, chunk and worker sizes passed to index_data.
+
+		Returns:
+			The number of upserted and deleted vectors.
+		"""
+
+		from db.manifest import Manifest, content_hash
+
+		manifest = manifest or Manifest()
+		dedup = kwargs.pop("dedup", None)
+		dedup = dedup if dedup is not None else utils.indexing_params["dedup"]
+
+		# every field stored in the metadata is hashed, so a new retailer or brand re-upserts the offer
+		rows, members = parse_data(data, offers), {}
+		if dedup:
+			rows, members = collapse(rows, utils.indexing_params["dedup_threshold"])
+		current = {d[3]: content_hash(d[1:3] + d[4:6] + members.get(d[3], [])) for d in rows}
+		changed, removed = manifest.diff("index", current)
+
+		changed = set(changed)
+		delta = [d for d in rows if d[3] in changed]
+		if delta:
+			self.index_data(delta, dedup=False, members=members, **kwargs)
+
+		chunk_size = kwargs.get("chunk_size") or utils.indexing_params["chunk_size"]
+		for i in range(0, len(removed), chunk_size):
+			self.index.delete(ids=removed[i:i + chunk_size])
+		if removed and hasattr(self.index, "save"):
+			self.index.save()
 
-		self.index.upsert(embeddings)
+		manifest.update("index", current)
+		print(f"Synced index: {len(delta)} upserted, {len(removed)} deleted")
 
-def connect_to_db(index_name):
+		return len(delta), len(removed)
+
+def _connect_pinecone(index_name):
+	"""
+	Connects to a managed Pinecone index.
+	"""
+
+	from pinecone import Pinecone
+
+	pc = Pinecone(api_key=utils.api_key,
+				  similarity_metric=utils.params["sim_mets"][0],
+				  search_algorithm=utils.params["search_algo"][0])
+
+	return pc.Index(index_name, algorithm=utils.params["index_algo"][0])
+
+
+def _connect_local(index_name):
+	"""
+	Opens an in-process index backed by memory-mapped arrays.
+	"""
+
+	from .local_index import LocalIndex
+
+	return LocalIndex(index_name)
+
+
+# Every backend returns an object with Pinecone's upsert/query/delete interface
+backends = {"pinecone": _connect_pinecone,
+			"local": _connect_local}
+
+
+def connect_to_db(index_name, backend=None):
 	"""
 	Connects to the vector db with a specified index.
 
 	Args:
 		index_name: The specific index used.
+		backend: A key of `backends`, defaults to utils.backend.
 
 	Returns:
 		The index to query from.
 	"""
 
-	pc = Pinecone(api_key=utils.api_key,
-				  similarity_metric=utils.params["sim_mets"][0],
-				  search_algorithm=utils.params["search_algo"][0])
+	backend = backend or utils.backend
+	if backend not in backends:
+		raise ValueError(f"Unknown vector backend: {backend}")
+
+	return backends[backend](index_name)
+
+def build_metadata(d, members=None):
+	"""
+	Builds the metadata stored with an offer's vector. Retailer, brand and the
+	category list are stored as structured fields so queries can filter on them.
+
+	Args:
+		d: A row returned by parse_data.
+		members: The IDs of the near-duplicates collapsed into this offer.
+
+	Returns:
+		The metadata dictionary.
+	"""
 
-	index = pc.Index(index_name, algorithm=utils.params["index_algo"][0])
+	metadata = {"Categories": d[2], "Offer": d[1], "CategoryList": list(parse_categories(d[2]))}
+	if len(d) > 5:
+		# offers without an offer_retailer row have empty retailer and brand
+		if d[4]:
+			metadata["Retailer"] = d[4].upper()
+		if d[5]:
+			metadata["Brand"] = d[5].upper()
+	if members:
+		metadata["Members"] = list(members)
 
-	return index
+	return metadata
 
-def parse_data(data):
+
+def parse_data(data, offers=None):
 	"""
-	Extracts experiences and skills to create a string that will be embedded. Also
-	included is the metadata for each resume.
+	Converts the processed offers into rows of strings to embed, joining each
+	offer's retailer and brand from `offers` when given.
+
+	Args:
+		data: The processed offers.
+		offers: The offer_retailer rows, keyed by UNIQUE_ID.
 
 	Returns:
 		The parsed data.
 	"""
 
+	if offers is not None:
+		data = data.merge(offers[["UNIQUE_ID", "RETAILER", "BRAND"]].drop_duplicates("UNIQUE_ID"),
+						  on="UNIQUE_ID", how="left")
 
-	
-	parsed_data = data.applymap(str).values.tolist()
-
+	# missing values become empty strings rather than NaN floats
+	parsed_data = data.fillna("").astype(str).values.tolist()
 
 	return parsed_data
 
 
-def main():
+def read_chunks(path: str, offers: pd.DataFrame = None, chunk_size: int = 256, start: int = 0):
+	"""
+	Reads a processed offers CSV lazily, chunk by chunk.
+
+	Args:
+		path (str): The processed offers CSV.
+		offers (pd.DataFrame): The offer_retailer rows joined onto each chunk.
+		chunk_size (int): The number of rows per chunk.
+		start (int): The number of data rows to skip.
+
+	Yields:
+		The row offset after the chunk and its rows as returned by parse_data.
+	"""
+
+	end = start
+	skip = range(1, start + 1) if start else None
+	with pd.read_csv(path, chunksize=chunk_size, skiprows=skip) as reader:
+		for chunk in reader:
+			end += len(chunk)
+			yield end, parse_data(chunk, offers)
+
+
+def source_version(source: str) -> dict:
+	"""
+	Returns:
+		dict: The path, size and modification time identifying the current contents of `source`.
+	"""
+
+	stat = os.stat(source)
+	return {"source": os.path.abspath(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_checkpoint(checkpoint_path: str, source: str) -> int:
+	"""
+	Returns:
+		int: The row to resume `source` from, or 0 without a checkpoint for it.
+		A checkpoint written for an earlier version of the file is ignored.
+	"""
+
+	if not os.path.exists(checkpoint_path):
+		return 0
+
+	with open(checkpoint_path) as f:
+		checkpoint = json.load(f)
+
+	version = source_version(source)
+	return checkpoint["offset"] if all(checkpoint.get(k) == v for k, v in version.items()) else 0
+
+
+def write_checkpoint(checkpoint_path: str, version: dict, offset: int) -> None:
+	"""
+	Records that the first `offset` rows of the file identified by `version`
+	are indexed, with an atomic rename.
+	"""
+
+	os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+	tmp = f"{checkpoint_path}.tmp"
+	with open(tmp, "w") as f:
+		json.dump({**version, "offset": offset}, f)
+	os.replace(tmp, checkpoint_path)
+
+
+def main(incremental: bool = False):
 	"""
 	The main function that initializes the Pinecone client, creates embeddings, and upserts them into the index.
+
+	Args:
+		incremental: Whether to only index offers changed since the last run.
 	"""
 
-	# Store actual data
-	data = pd.read_csv("../data/processed_offers.csv")
-	# print(data)
-	parsed_data = parse_data(data)
-	# print(parsed_data)
+	# Store actual data, found relative to this file so the module runs from any directory
+	data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+	offers = pd.read_csv(os.path.join(data_dir, 'offer_retailer.csv'), usecols=["UNIQUE_ID", "RETAILER", "BRAND"])
 
 	pc = PineCone(index_name = 'beta-index')
-	embeddings = pc.create_embeddings(parsed_data)
-	# print(embeddings)
-	pc.upsert_embeddings(embeddings)
+	if incremental:
+		pc.sync_data(pd.read_csv(os.path.join(data_dir, 'processed_offers.csv')), offers=offers)
+	elif utils.indexing_params["dedup"]:
+		# clustering needs every offer at once
+		pc.index_data(parse_data(pd.read_csv(os.path.join(data_dir, 'processed_offers.csv')), offers))
+	else:
+		pc.index_stream(os.path.join(data_dir, 'processed_offers.csv'), offers)
 
 	
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	import sys
+	main(incremental="--incremental" in sys.argv)
\ No newline at end of file
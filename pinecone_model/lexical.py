@@ -0,0 +1,191 @@
+# In-memory BM25 index over offer text, brands and retailers
+
+import math
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .indexer import build_metadata
+
+# The placeholder data_preprocess.fill_retailer stores for offers without a retailer
+UNSPECIFIED_RETAILER = "NOT RETAILER SPECIFIC"
+
+# Words that carry no information in a coupon search; a query made of these and
+# one brand or retailer name is treated as a lookup of that name
+FILLER = frozenset(["a", "about", "an", "any", "at", "coupon", "coupons", "deal", "deals", "discount",
+					"discounts", "find", "for", "from", "get", "i", "im", "in", "looking", "m", "me",
+					"my", "need", "of", "offer", "offers", "on", "please", "promo", "promos", "related",
+					"savings", "show", "some", "the", "to", "want", "with"])
+
+
+def tokenize(text: str) -> List[str]:
+	"""
+	Args:
+		text (str): Any text.
+
+	Returns:
+		List[str]: The lowercased word tokens.
+	"""
+
+	return re.findall(r"\w+", text.lower())
+
+
+class BM25Index():
+	"""
+	An inverted index scoring offers with Okapi BM25. Each offer is indexed by
+	its text, brand and retailer, and the brand and retailer names are kept in a
+	lookup table so queries naming exactly one of them skip the scoring.
+
+	Attributes:
+		ids (List[str]): The offer IDs.
+		metadata (List[Dict]): The metadata of each offer, as stored with its vector.
+		postings (Dict[str, Tuple[np.ndarray, np.ndarray]]): The rows and term counts of each token.
+		names (Dict[Tuple[str, ...], np.ndarray]): The rows of each tokenized brand and retailer name.
+	"""
+
+	def __init__(self, ids: List[str], metadata: List[Dict], k1: float = 1.5, b: float = 0.75) -> None:
+		"""
+		Args:
+			ids (List[str]): The offer IDs.
+			metadata (List[Dict]): The metadata of each offer, with "Offer" and
+				optionally "Brand" and "Retailer".
+			k1 (float): The BM25 term frequency saturation.
+			b (float): The BM25 length normalization.
+		"""
+
+		self.ids = list(ids)
+		self.metadata = list(metadata)
+		self.k1 = k1
+		self.b = b
+
+		postings, names = {}, {}
+		lengths = np.zeros(len(self.ids), dtype=np.float32)
+		for row, m in enumerate(self.metadata):
+			fields = [m.get("Offer", "")]
+			for field in ["Brand", "Retailer"]:
+				name = m.get(field)
+				if name and name != UNSPECIFIED_RETAILER:
+					fields.append(name)
+					names.setdefault(tuple(tokenize(name)), []).append(row)
+
+			tokens = tokenize(" ".join(fields))
+			lengths[row] = len(tokens)
+			counts = {}
+			for token in tokens:
+				counts[token] = counts.get(token, 0) + 1
+			for token, count in counts.items():
+				postings.setdefault(token, []).append((row, count))
+
+		self.postings = {token: (np.array([r for r, _ in p], dtype=np.int64), np.array([c for _, c in p], dtype=np.float32))
+						 for token, p in postings.items()}
+		self.names = {name: np.array(sorted(set(rows)), dtype=np.int64) for name, rows in names.items() if name}
+		self._norm = k1 * (1 - b + b * lengths / (lengths.mean() if len(lengths) else 1.0))
+
+	def __len__(self) -> int:
+		return len(self.ids)
+
+	def scores(self, q: str) -> np.ndarray:
+		"""
+		Args:
+			q (str): The query text.
+
+		Returns:
+			np.ndarray: The BM25 score of every offer.
+		"""
+
+		scores = np.zeros(len(self.ids), dtype=np.float32)
+		n = len(self.ids)
+		for token in set(tokenize(q)):
+			posting = self.postings.get(token)
+			if posting is None:
+				continue
+			rows, tf = posting
+			idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+			scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])
+
+		return scores
+
+	def _matches(self, scores: np.ndarray, rows: np.ndarray, top_k: int) -> Dict:
+		top = rows[np.argsort(-scores[rows], kind="stable")[:top_k]]
+		return {"matches": [{"id": self.ids[i], "score": float(scores[i]), "metadata": self.metadata[i]} for i in top],
+				"namespace": ""}
+
+	def search(self, q: str, top_k: int = 10) -> Dict:
+		"""
+		Finds the offers with the highest BM25 score for the query.
+
+		Args:
+			q (str): The query text.
+			top_k (int): The number of results to return.
+
+		Returns:
+			Dict: The offers containing at least one query token, in the Pinecone `matches` format.
+		"""
+
+		scores = self.scores(q)
+		return self._matches(scores, np.flatnonzero(scores > 0), top_k)
+
+	def exact_match(self, q: str, top_k: int = 10) -> Optional[Dict]:
+		"""
+		Answers queries that only name a brand or retailer, such as "coupons
+		related to pepsi", with that name's offers ranked by BM25.
+
+		Args:
+			q (str): The query text.
+			top_k (int): The number of results to return.
+
+		Returns:
+			Dict: The offers of the named brand or retailer in the Pinecone `matches`
+			format, or None if the query is not such a lookup.
+		"""
+
+		name = tuple(t for t in tokenize(q) if t not in FILLER)
+		rows = self.names.get(name)
+		if rows is None:
+			return None
+
+		return self._matches(self.scores(q), rows, top_k)
+
+
+def build_index(parsed_data: List[List[str]], members: Dict[str, List[str]] = None) -> BM25Index:
+	"""
+	Builds the BM25 index from the rows returned by indexer.parse_data, so
+	lexical matches carry the same metadata as vector matches.
+
+	Args:
+		parsed_data (List[List[str]]): The parsed offers, joined with their retailers and brands.
+		members (Dict[str, List[str]]): The collapsed duplicates of each representative offer.
+
+	Returns:
+		BM25Index: The index.
+	"""
+
+	# an offer listed twice keeps its last row, as in the vector index
+	rows = list({d[3]: d for d in parsed_data}.values())
+	members = members or {}
+	return BM25Index([d[3] for d in rows], [build_metadata(d, members.get(d[3])) for d in rows])
+
+
+def reciprocal_rank_fusion(results: List[List[Dict]], k: int = 60) -> List[Dict]:
+	"""
+	Merges ranked match lists by summing 1 / (k + rank) over the lists each
+	match appears in.
+
+	Args:
+		results (List[List[Dict]]): The ranked matches of each retriever.
+		k (int): The rank offset damping the weight of top ranks.
+
+	Returns:
+		List[Dict]: The distinct matches ordered by fused score, which replaces "score".
+	"""
+
+	fused = {}
+	for matches in results:
+		for rank, m in enumerate(matches, start=1):
+			entry = fused.get(m["id"])
+			if entry is None:
+				entry = fused[m["id"]] = {"id": m["id"], "score": 0.0, "metadata": m.get("metadata", {})}
+			entry["score"] += 1.0 / (k + rank)
+
+	return sorted(fused.values(), key=lambda m: m["score"], reverse=True)
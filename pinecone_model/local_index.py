@@ -0,0 +1,558 @@
+# In-process vector index stored as memory-mapped NumPy arrays
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import utils, versions
+
+# The number of set bits of every byte value, for Hamming distances between binary codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_popcount = getattr(np, "bitwise_count", _POPCOUNT.__getitem__)
+
+
+class LocalIndex():
+	"""
+	A local stand-in for a Pinecone index. It exposes the same `upsert`, `query`,
+	`delete` and `describe_index_stats` calls so it can be used anywhere the
+	Pinecone index is used, and its query results carry the same `matches` structure.
+
+	Vectors, ids and metadata are persisted as `.npy` files in a new version
+	directory under `root/index_name` on every save, published by swapping the
+	`current` symlink, and opened with `mmap_mode='r'`, so several processes
+	share the same pages and never read a half-written index.
+
+	Upserts and deletes are buffered and merged into the arrays in one pass when
+	the index is saved or next queried, so indexing in chunks copies the index
+	once rather than once per chunk.
+
+	With quantization enabled, `save` also stores int8 or binary codes of the
+	vectors. Queries scan the codes and rescore only the best `rescore * top_k`
+	candidates against the float32 vectors, so only those rows of vectors.npy
+	are paged in.
+
+	Attributes:
+		mode (str): "flat" for exact search or "ivf" for an inverted file index.
+		nlist (int): The number of IVF clusters.
+		nprobe (int): The number of IVF clusters scanned per query.
+		autosave (bool): Whether every upsert/delete is persisted immediately.
+		quantization (str): "none", "int8" or "binary".
+		rescore (int): The candidates rescored in float32 per requested result.
+	"""
+
+	def __init__(self, index_name: str, root: Optional[str] = None, dimension: int = 384,
+				 mode: Optional[str] = None, nlist: Optional[int] = None, nprobe: Optional[int] = None,
+				 autosave: bool = True, quantization: Optional[str] = None, rescore: Optional[int] = None) -> None:
+		"""
+		Opens the index if it exists on disk, otherwise creates an empty one.
+
+		Args:
+			index_name (str): The specific index used.
+			root (str): The directory holding all local indexes.
+			dimension (int): The dimensionality of the stored vectors.
+			mode (str): "flat" or "ivf".
+			nlist (int): The number of IVF clusters.
+			nprobe (int): The number of IVF clusters scanned per query.
+			autosave (bool): Whether every upsert/delete is persisted immediately.
+			quantization (str): "none", "int8" or "binary".
+			rescore (int): The candidates rescored in float32 per requested result.
+		"""
+
+		self.path = os.path.join(root or utils.local_params["root"], index_name)
+		self.dimension = dimension
+		self.mode = mode or utils.local_params["mode"]
+		self.nlist = nlist or utils.local_params["nlist"]
+		self.nprobe = nprobe or utils.local_params["nprobe"]
+		self.autosave = autosave
+		self.quantization = quantization or utils.local_params["quantization"]
+		self.rescore = rescore or utils.local_params["rescore"]
+		self._lock = threading.RLock()
+
+		self._vectors = np.zeros((0, dimension), dtype=np.float32)
+		self._ids = np.zeros(0, dtype="U1")
+		self._metadata = np.zeros(0, dtype="U1")
+		self._centroids = None
+		self._list_offsets = None
+		self._list_rows = None
+		self._codes = None
+		self._code_scale = None
+		# the row of every stored id, and the upserts and deletes not merged yet
+		self._positions = {}
+		self._pending = []
+		self._field_indexes = {}
+		self._load()
+
+
+	def _load(self) -> None:
+		"""
+		Memory-maps the arrays of the published version if the index exists on disk.
+		"""
+
+		directory = versions.current(self.path)
+		if directory is None:
+			return
+
+		def file(name):
+			return os.path.join(directory, f"{name}.npy")
+
+		self._vectors = np.load(file("vectors"), mmap_mode="r")
+		self._ids = np.load(file("ids"), mmap_mode="r")
+		self._metadata = np.load(file("metadata"), mmap_mode="r")
+
+		self._centroids = self._list_offsets = self._list_rows = None
+		if os.path.exists(file("centroids")):
+			self._centroids = np.load(file("centroids"), mmap_mode="r")
+			self._list_offsets = np.load(file("list_offsets"), mmap_mode="r")
+			self._list_rows = np.load(file("list_rows"), mmap_mode="r")
+
+		self._codes = self._code_scale = None
+		if self.quantization != "none" and os.path.exists(file("codes")):
+			self._codes = np.load(file("codes"), mmap_mode="r")
+			if os.path.exists(file("code_scale")):
+				self._code_scale = np.load(file("code_scale"))
+
+		self._positions = {str(id): i for i, id in enumerate(self._ids)}
+		self._field_indexes = {}
+
+
+	def _merge(self) -> None:
+		"""
+		Applies the pending upserts and deletes in one pass. Each id keeps the
+		row of its last upsert unless a later delete removes it, and rows stay in
+		the order of their last upsert.
+		"""
+
+		if not self._pending:
+			return
+
+		# the position of every live id in the stored rows followed by the pending ones
+		latest = dict(self._positions)
+		vectors, ids, metadata = [np.asarray(self._vectors, dtype=np.float32)], [self._ids], [self._metadata]
+		offset = len(self._ids)
+		for chunk_ids, chunk_vectors, chunk_metadata in self._pending:
+			if chunk_vectors is None:
+				for id in chunk_ids:
+					latest.pop(id, None)
+				continue
+
+			for j, id in enumerate(chunk_ids):
+				latest[id] = offset + j
+			vectors.append(chunk_vectors)
+			ids.append(np.array(chunk_ids))
+			metadata.append(np.array(chunk_metadata))
+			offset += len(chunk_ids)
+
+		keep = np.fromiter(sorted(latest.values()), dtype=np.int64, count=len(latest))
+		self._vectors = np.concatenate(vectors)[keep]
+		self._ids = np.concatenate(ids)[keep]
+		self._metadata = np.concatenate(metadata)[keep]
+		self._positions = {str(id): i for i, id in enumerate(self._ids)}
+		self._pending = []
+
+		self._field_indexes = {}
+		self._centroids = self._list_offsets = self._list_rows = None
+		self._codes = self._code_scale = None
+
+
+	def save(self) -> None:
+		"""
+		Merges the pending changes, writes the index to a new version directory
+		with the IVF lists when in "ivf" mode and the codes when quantized,
+		publishes it and re-opens everything memory-mapped.
+		"""
+
+		with self._lock:
+			self._merge()
+			arrays = {"vectors": np.ascontiguousarray(self._vectors, dtype=np.float32),
+					  "ids": np.asarray(self._ids),
+					  "metadata": np.asarray(self._metadata)}
+
+			if self.mode == "ivf" and len(self._vectors) > self.nlist:
+				centroids, offsets, rows = self._train_ivf(arrays["vectors"])
+				arrays.update({"centroids": centroids, "list_offsets": offsets, "list_rows": rows})
+			if self.quantization != "none" and len(self._vectors):
+				arrays["codes"], scale = self._quantize(arrays["vectors"])
+				if scale is not None:
+					arrays["code_scale"] = scale
+
+			def write(directory):
+				for name, array in arrays.items():
+					np.save(os.path.join(directory, f"{name}.npy"), array)
+
+			versions.publish(self.path, write)
+			self._load()
+
+
+	def _train_ivf(self, vectors: np.ndarray, iterations: int = 10):
+		"""
+		Clusters the vectors with spherical k-means and groups row numbers by cluster.
+
+		Args:
+			vectors (np.ndarray): The stored vectors.
+			iterations (int): The number of k-means iterations.
+
+		Returns:
+			The centroids, the offsets of each cluster in `rows` and the row numbers.
+		"""
+
+		rng = np.random.default_rng(0)
+		centroids = vectors[rng.choice(len(vectors), self.nlist, replace=False)].copy()
+
+		for _ in range(iterations):
+			assignments = np.argmax(vectors @ centroids.T, axis=1)
+			for c in range(self.nlist):
+				members = vectors[assignments == c]
+				if len(members):
+					centroid = members.mean(axis=0)
+					centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+		assignments = np.argmax(vectors @ centroids.T, axis=1)
+		rows = np.argsort(assignments, kind="stable").astype(np.int64)
+		offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.nlist))]).astype(np.int64)
+
+		return centroids.astype(np.float32), offsets, rows
+
+
+	def _quantize(self, vectors: np.ndarray):
+		"""
+		Encodes the vectors as int8 codes with a per-dimension scale, or as sign
+		bits packed eight to a byte.
+
+		Args:
+			vectors (np.ndarray): The stored vectors.
+
+		Returns:
+			The codes and the int8 scale (None for binary codes).
+		"""
+
+		if self.quantization == "int8":
+			scale = np.abs(vectors).max(axis=0) / 127.0
+			scale[scale == 0] = 1.0
+			codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+			return codes, scale.astype(np.float32)
+
+		if self.quantization == "binary":
+			return np.packbits(vectors > 0, axis=1), None
+
+		raise ValueError(f"Unknown quantization: {self.quantization}")
+
+
+	def _approx_scores(self, codes: np.ndarray, scale: Optional[np.ndarray], xq: np.ndarray,
+					   rows: Optional[np.ndarray], chunk_bytes: int = 1 << 24) -> np.ndarray:
+		"""
+		Scores queries against the codes, chunk by chunk to bound the temporaries.
+		int8 codes approximate the dot product; binary codes score by the number
+		of matching sign bits.
+
+		Args:
+			codes (np.ndarray): The stored codes.
+			scale (np.ndarray): The per-dimension int8 scale, or None for binary codes.
+			xq (np.ndarray): The query vectors, one per row.
+			rows (np.ndarray): The candidate rows, or None to score every row.
+			chunk_bytes (int): The approximate size of the temporaries per chunk.
+
+		Returns:
+			np.ndarray: The approximate scores, one row per candidate and one column per query.
+		"""
+
+		n = len(codes) if rows is None else len(rows)
+		scores = np.empty((n, len(xq)), dtype=np.float32)
+
+		if scale is not None:
+			queries = (xq * scale).T.astype(np.float32)
+			step = max(1, chunk_bytes // (4 * self.dimension))
+		else:
+			bits = np.packbits(xq > 0, axis=1)
+			step = max(1, chunk_bytes // (bits.shape[1] * len(xq)))
+
+		for start in range(0, n, step):
+			block = codes[start:start + step] if rows is None else codes[rows[start:start + step]]
+			if scale is not None:
+				scores[start:start + step] = block.astype(np.float32) @ queries
+			else:
+				hamming = _popcount(block[:, None, :] ^ bits[None, :, :]).sum(axis=2, dtype=np.int32)
+				scores[start:start + step] = self.dimension - 2 * hamming
+
+		return scores
+
+
+	def _rescore(self, approx: np.ndarray, rows: Optional[np.ndarray], xq: np.ndarray,
+				 vectors: np.ndarray, top_k: int):
+		"""
+		Rescores the best `rescore * top_k` candidates by approximate score with the
+		float32 vectors.
+
+		Args:
+			approx (np.ndarray): The approximate scores of the candidates.
+			rows (np.ndarray): The candidate rows, or None if every row was scored.
+			xq (np.ndarray): The query vector.
+			vectors (np.ndarray): The stored float32 vectors.
+			top_k (int): The number of results requested.
+
+		Returns:
+			The exact scores and row numbers of the shortlisted candidates.
+		"""
+
+		n = min(len(approx), top_k * self.rescore)
+		if n == 0:
+			return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+		shortlist = np.argpartition(-approx, n - 1)[:n] if n < len(approx) else np.arange(len(approx))
+		shortlist = np.sort(shortlist if rows is None else rows[shortlist])
+
+		return vectors[shortlist] @ xq, shortlist
+
+
+	def upsert(self, vectors: List, **kwargs) -> Dict:
+		"""
+		Inserts or overwrites vectors. The change is buffered until the next save
+		or query, or saved right away with autosave.
+
+		Args:
+			vectors (List): (id, values, metadata) tuples or dicts with the same keys,
+				as accepted by the Pinecone client.
+
+		Returns:
+			Dict: The number of upserted vectors.
+		"""
+
+		if not vectors:
+			return {"upserted_count": 0}
+
+		ids, values, metadata = [], [], []
+		for v in vectors:
+			if isinstance(v, dict):
+				v = (v["id"], v["values"], v.get("metadata", {}))
+			ids.append(str(v[0]))
+			values.append(v[1])
+			metadata.append(json.dumps(v[2] if len(v) > 2 else {}))
+
+		values = np.asarray(values, dtype=np.float32).reshape(-1, self.dimension)
+
+		with self._lock:
+			self._pending.append((ids, values, metadata))
+			if self.autosave:
+				self.save()
+
+		return {"upserted_count": len(ids)}
+
+
+	def delete(self, ids: List[str], **kwargs) -> Dict:
+		"""
+		Removes vectors by id. Like upserts, deletes are buffered until the next
+		save or query.
+
+		Args:
+			ids (List[str]): The ids to remove.
+		"""
+
+		with self._lock:
+			self._pending.append(([str(id) for id in ids], None, None))
+			if self.autosave:
+				self.save()
+
+		return {}
+
+
+	def _field_index(self, field: str) -> Dict[str, np.ndarray]:
+		"""
+		Builds (once per index version) an inverted index from the values of a
+		metadata field to the rows holding them. List values index every element.
+
+		Args:
+			field (str): The metadata field.
+
+		Returns:
+			Dict[str, np.ndarray]: The sorted row numbers of each value.
+		"""
+
+		index = self._field_indexes.get(field)
+		if index is None:
+			rows = {}
+			for i, raw in enumerate(self._metadata):
+				value = json.loads(str(raw)).get(field)
+				for v in (value if isinstance(value, list) else [value]):
+					if v is not None:
+						rows.setdefault(str(v), []).append(i)
+			index = {v: np.array(r, dtype=np.int64) for v, r in rows.items()}
+			self._field_indexes[field] = index
+
+		return index
+
+
+	def _filter_rows(self, filter: Dict) -> np.ndarray:
+		"""
+		Resolves a Pinecone-style metadata filter to the matching row numbers.
+		Supports `$eq`, `$in`, `$and` and plain values (implicit `$eq`).
+
+		Args:
+			filter (Dict): The metadata filter.
+
+		Returns:
+			np.ndarray: The sorted row numbers matching every condition.
+		"""
+
+		rows = np.arange(len(self._ids), dtype=np.int64)
+
+		for field, condition in filter.items():
+			if field == "$and":
+				for sub in condition:
+					rows = np.intersect1d(rows, self._filter_rows(sub), assume_unique=True)
+				continue
+
+			if not isinstance(condition, dict):
+				condition = {"$eq": condition}
+
+			index = self._field_index(field)
+			for op, value in condition.items():
+				if op == "$eq":
+					values = [value]
+				elif op == "$in":
+					values = list(value)
+				else:
+					raise ValueError(f"Unsupported filter operator: {op}")
+
+				matched = [index[str(v)] for v in values if str(v) in index]
+				matched = np.unique(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+				rows = np.intersect1d(rows, matched, assume_unique=True)
+
+		return rows
+
+
+	def _candidates(self, xq: np.ndarray) -> Optional[np.ndarray]:
+		"""
+		Selects the rows of the `nprobe` closest IVF clusters, or None for a flat scan.
+		"""
+
+		if self._centroids is None:
+			return None
+
+		probe = np.argsort(-(self._centroids @ xq))[:self.nprobe]
+		return np.concatenate([self._list_rows[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probe])
+
+
+	def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False,
+			  filter: Optional[Dict] = None, **kwargs) -> Dict:
+		"""
+		Finds the stored vectors with the highest dot product to the query vector.
+		With a metadata filter only the matching rows are scored, so top_k
+		results come back already filtered.
+
+		Args:
+			vector (List[float]): The query vector.
+			top_k (int): The number of results to return.
+			include_metadata (bool): Whether to include the stored metadata.
+			filter (Dict): An optional Pinecone-style metadata filter.
+
+		Returns:
+			Dict: The results in the Pinecone `matches` format.
+		"""
+
+		xq = np.asarray(vector, dtype=np.float32)
+
+		with self._lock:
+			self._merge()
+			vectors, ids, metadata = self._vectors, self._ids, self._metadata
+			codes, scale = self._codes, self._code_scale
+			rows = self._filter_rows(filter) if filter else self._candidates(xq)
+
+		if codes is not None:
+			approx = self._approx_scores(codes, scale, xq[None, :], rows)[:, 0]
+			scores, rows = self._rescore(approx, rows, xq, vectors, top_k)
+		elif rows is None:
+			scores = vectors @ xq
+		else:
+			scores = vectors[rows] @ xq
+
+		return self._top_matches(scores, rows, ids, metadata, top_k, include_metadata)
+
+
+	def query_many(self, vectors: List[List[float]], top_k: int = 10, include_metadata: bool = False,
+				   filter: Optional[Dict] = None, **kwargs) -> List[Dict]:
+		"""
+		Runs several queries at once. A flat index scores every query with a single
+		matrix multiplication; an IVF index probes each query's clusters separately.
+
+		Args:
+			vectors (List[List[float]]): The query vectors.
+			top_k (int): The number of results to return per query.
+			include_metadata (bool): Whether to include the stored metadata.
+			filter (Dict): An optional Pinecone-style metadata filter shared by every query.
+
+		Returns:
+			List[Dict]: The results of each query, in order.
+		"""
+
+		with self._lock:
+			self._merge()
+			stored, ids, metadata, centroids = self._vectors, self._ids, self._metadata, self._centroids
+			codes, scale = self._codes, self._code_scale
+			rows = self._filter_rows(filter) if filter else None
+
+		if centroids is not None and rows is None:
+			return [self.query(v, top_k=top_k, include_metadata=include_metadata, **kwargs) for v in vectors]
+
+		xq = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+
+		if codes is not None:
+			approx = self._approx_scores(codes, scale, xq, rows)
+			results = []
+			for j in range(len(xq)):
+				scores, shortlist = self._rescore(approx[:, j], rows, xq[j], stored, top_k)
+				results.append(self._top_matches(scores, shortlist, ids, metadata, top_k, include_metadata))
+			return results
+
+		scores = (stored if rows is None else stored[rows]) @ xq.T
+
+		return [self._top_matches(scores[:, j], rows, ids, metadata, top_k, include_metadata)
+				for j in range(len(xq))]
+
+
+	def _top_matches(self, scores: np.ndarray, rows: Optional[np.ndarray], ids: np.ndarray,
+					 metadata: np.ndarray, top_k: int, include_metadata: bool) -> Dict:
+		"""
+		Selects the highest scores and builds the Pinecone `matches` structure.
+
+		Args:
+			scores (np.ndarray): The scores of the candidate rows.
+			rows (np.ndarray): The row numbers of the candidates, or None if every row was scored.
+			ids (np.ndarray): The stored ids.
+			metadata (np.ndarray): The stored metadata.
+			top_k (int): The number of results to return.
+			include_metadata (bool): Whether to include the stored metadata.
+
+		Returns:
+			Dict: The results in the Pinecone `matches` format.
+		"""
+
+		top_k = min(top_k, len(scores))
+		if top_k == 0:
+			return {"matches": [], "namespace": ""}
+
+		top = np.argpartition(-scores, top_k - 1)[:top_k]
+		top = top[np.argsort(-scores[top])]
+
+		matches = []
+		for i in top:
+			row = i if rows is None else rows[i]
+			match = {"id": str(ids[row]), "score": float(scores[i])}
+			if include_metadata:
+				match["metadata"] = json.loads(str(metadata[row]))
+			matches.append(match)
+
+		return {"matches": matches, "namespace": ""}
+
+
+	def describe_index_stats(self) -> Dict:
+		"""
+		Returns:
+			Dict: The dimension and number of vectors in the index.
+		"""
+
+		with self._lock:
+			self._merge()
+			return {"dimension": self.dimension, "total_vector_count": len(self._ids), "mode": self.mode,
+					"quantization": self.quantization if self._codes is not None else "none"}
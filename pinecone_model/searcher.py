@@ -1,24 +1,309 @@
 # Manages vector search queries and results in Pinecone
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
-from pinecone import Pinecone
 from . import utils, indexer
-from FlagEmbedding import FlagReranker
+from .cache import LRUCache, normalize_query
+from .categories import get_tree
+from .lexical import UNSPECIFIED_RETAILER, BM25Index, reciprocal_rank_fusion
+import tracing
 import json
 import random
 from pprint import pprint
 
-# Setting use_fp16 to True speeds up computation with a slight performance degradation
-reranker = FlagReranker('BAAI/bge-reranker-large', use_fp16=True)
-
 class Searcher():
-	def __init__(self, index_name: str) -> None:
-		self.index = indexer.connect_to_db(index_name)
+	def __init__(self, index_name: str, backend: str = None, lexical: BM25Index = None) -> None:
+		"""
+		Args:
+			index_name (str): The vector index to search.
+			backend (str): "pinecone" or "local", defaults to utils.backend.
+			lexical (BM25Index): An optional BM25 index; queries are then answered
+				by hybrid retrieval when utils.hybrid_params["enabled"] is set.
+		"""
+
+		self.index = indexer.connect_to_db(index_name, backend=backend)
+		self.lexical = lexical
+		self.query_cache = LRUCache(maxsize=utils.cache_params["size"], path=utils.cache_params["path"])
+		self.pair_cache = LRUCache(maxsize=utils.rerank_params["cache_size"])
+
+	def embed(self, q: str) -> List[float]:
+		"""
+		Encodes a query, reusing the cached embedding of previously seen queries.
+
+		Args:
+			q (str): The query text.
+
+		Returns:
+			List[float]: The query embedding.
+		"""
+
+		key = normalize_query(q)
+		xq = self.query_cache.get(key)
+		if xq is None:
+			xq = utils.get_embedding_model().encode(key).tolist()
+			self.query_cache.put(key, xq)
+
+		return xq
+
+	def embed_many(self, queries: List[str]) -> List[List[float]]:
+		"""
+		Encodes several queries, running every uncached query through the model
+		in a single batched forward pass.
+
+		Args:
+			queries (List[str]): The query texts.
+
+		Returns:
+			List[List[float]]: The query embeddings, in order.
+		"""
+
+		keys = [normalize_query(q) for q in queries]
+		vectors = {}
+		for key in keys:
+			if key not in vectors:
+				vectors[key] = self.query_cache.get(key)
+
+		missing = [key for key, xq in vectors.items() if xq is None]
+		if missing:
+			encoded = utils.get_embedding_model().encode(missing, batch_size=utils.indexing_params["batch_size"])
+			for key, xq in zip(missing, encoded):
+				vectors[key] = xq.tolist()
+				self.query_cache.put(key, vectors[key])
+
+		return [vectors[key] for key in keys]
+
+	def rerank(self, q: str, matches: List, k: int, budget_ms: float = None) -> Dict:
+		"""
+		Rescores (query, offer) pairs with the cross-encoder. Pairs are scored in
+		batches and previously scored pairs come from `pair_cache`. If the latency
+		budget runs out before every candidate is scored, the vector order is kept.
+
+		Args:
+			q (str): The query text.
+			matches (List): The vector search matches, which need an "Offer" in their metadata.
+			k (int): The number of results to return.
+			budget_ms (float): The time allowed for scoring in milliseconds.
+
+		Returns:
+			Dict: The reranked results in the Pinecone `matches` format, plus rerank timings.
+		"""
+
+		budget_ms = budget_ms if budget_ms is not None else utils.rerank_params["budget_ms"]
+		batch_size = utils.rerank_params["batch_size"]
+		start_time = time.perf_counter()
+		key = normalize_query(q)
+
+		matches = [{"id": m["id"], "score": m["score"], "metadata": m["metadata"]} for m in matches]
+		stats = {"candidates": len(matches), "cached": 0, "scored": 0, "fallback": False}
+
+		if any("Offer" not in m["metadata"] for m in matches):
+			# indexed before offers were stored as metadata
+			stats["fallback"] = True
+			pending = []
+		else:
+			pending = []
+			for m in matches:
+				score = self.pair_cache.get((key, m["id"]))
+				if score is None:
+					pending.append(m)
+				else:
+					m["rerank_score"] = score
+					stats["cached"] += 1
+
+		for i in range(0, len(pending), batch_size):
+			if (time.perf_counter() - start_time) * 1000 > budget_ms:
+				stats["fallback"] = True
+				break
+
+			batch = pending[i:i + batch_size]
+			scores = utils.get_reranker().compute_score([[q, m["metadata"]["Offer"]] for m in batch], batch_size=batch_size)
+			if not isinstance(scores, list):
+				scores = [scores]
+
+			for m, score in zip(batch, scores):
+				m["rerank_score"] = float(score)
+				self.pair_cache.put((key, m["id"]), float(score))
+				stats["scored"] += 1
+
+		if not stats["fallback"]:
+			matches.sort(key=lambda m: m["rerank_score"], reverse=True)
+
+		stats["ms"] = (time.perf_counter() - start_time) * 1000
+
+		return {"matches": matches[:k], "rerank": stats}
+
+	def build_filter(self, retailer: str = None, brand: str = None, category: str = None) -> Dict:
+		"""
+		Builds a metadata filter for the vector query. A retailer also matches
+		offers redeemable at any retailer, and a category matches offers in that
+		category or in any of its descendants. Names are matched case-insensitively.
+
+		Args:
+			retailer (str): The retailer to restrict results to.
+			brand (str): The brand to restrict results to.
+			category (str): The category to restrict results to.
+
+		Returns:
+			Dict: The Pinecone-style filter, or None if nothing is filtered.
+		"""
+
+		conditions = []
+		if retailer:
+			conditions.append({"Retailer": {"$in": [retailer.upper(), UNSPECIFIED_RETAILER]}})
+		if brand:
+			conditions.append({"Brand": {"$eq": brand.upper()}})
+		if category:
+			conditions.append({"CategoryList": {"$in": get_tree().descendants(category)}})
+
+		if not conditions:
+			return None
+
+		return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+	def fuse(self, q: str, matches: List, k: int) -> List:
+		"""
+		Fuses vector matches with the BM25 matches of the query by reciprocal rank.
+
+		Args:
+			q (str): The query text.
+			matches (List): The vector search matches.
+			k (int): The number of results to return.
+
+		Returns:
+			List: The fused matches.
+		"""
+
+		lexical = self.lexical.search(q, top_k=max(k, utils.hybrid_params["fetch_k"]))["matches"]
+		return reciprocal_rank_fusion([matches, lexical], k=utils.hybrid_params["rrf_k"])[:k]
+
+	def hybrid(self, filter: Dict = None) -> bool:
+		"""
+		Returns:
+			bool: Whether queries with this filter use hybrid retrieval. Filtered
+			queries stay vector-only, since the filters are applied by the index.
+		"""
+
+		return self.lexical is not None and utils.hybrid_params["enabled"] and filter is None
+
+	def execute_query(self, q: str, k: int = 10, rerank: bool = None, fetch_k: int = None, budget_ms: float = None,
+					  retailer: str = None, brand: str = None, category: str = None):
+		"""
+		Finds the k offers closest to the query. With reranking enabled, fetch_k
+		candidates are retrieved from the index and reordered by the cross-encoder.
+		Retailer, brand and category filters are pushed into the vector query.
+
+		In hybrid mode, unfiltered queries that only name a brand or retailer are
+		answered from the BM25 index without encoding the query; other queries fuse
+		the vector and BM25 candidates before reranking.
+
+		Args:
+			q (str): The query text.
+			k (int): The number of results to return.
+			rerank (bool): Whether to rerank, defaults to utils.rerank_params["enabled"].
+			fetch_k (int): The number of candidates to rerank.
+			budget_ms (float): The time allowed for reranking in milliseconds.
+			retailer (str): Only return offers of this retailer.
+			brand (str): Only return offers of this brand.
+			category (str): Only return offers in this category or below it.
+
+		Returns:
+			The results in the Pinecone `matches` format.
+		"""
+
+		rerank = rerank if rerank is not None else utils.rerank_params["enabled"]
+		filter = self.build_filter(retailer, brand, category)
+		hybrid = self.hybrid(filter)
+
+		if hybrid:
+			with tracing.stage("lexical"):
+				exact = self.lexical.exact_match(q, top_k=k)
+			if exact is not None:
+				return exact
+
+		with tracing.stage("embed"):
+			xq = self.embed(q)
+
+		if not rerank and not hybrid:
+			with tracing.stage("vector_query"):
+				return self.index.query(vector=xq, top_k=k, include_metadata=True, filter=filter)
+
+		fetch_k = max(k, fetch_k or utils.rerank_params["fetch_k"]) if rerank else k
+		with tracing.stage("vector_query"):
+			xc = self.index.query(vector=xq, top_k=max(fetch_k, utils.hybrid_params["fetch_k"]) if hybrid else fetch_k,
+								  include_metadata=True, filter=filter)
+
+		if hybrid:
+			with tracing.stage("fusion"):
+				xc = {"matches": self.fuse(q, xc["matches"], fetch_k), "namespace": ""}
+
+		if not rerank:
+			return xc
+
+		with tracing.stage("rerank"):
+			return self.rerank(q, xc["matches"], k, budget_ms=budget_ms)
+
+	def execute_many(self, queries: List[str], k: int = 10, rerank: bool = None, fetch_k: int = None,
+					 workers: int = None, retailer: str = None, brand: str = None, category: str = None) -> Dict:
+		"""
+		Runs a batch of queries. Embeddings come from one batched encoder call, and
+		the index is queried with all vectors at once when it supports `query_many`
+		(the local index), otherwise with concurrent requests. In hybrid mode,
+		brand and retailer lookups are answered by the BM25 index and are not encoded.
+
+		Args:
+			queries (List[str]): The query texts.
+			k (int): The number of results to return per query.
+			rerank (bool): Whether to rerank, defaults to utils.rerank_params["enabled"].
+			fetch_k (int): The number of candidates to rerank per query.
+			workers (int): The number of concurrent index requests.
+			retailer (str): Only return offers of this retailer.
+			brand (str): Only return offers of this brand.
+			category (str): Only return offers in this category or below it.
+
+		Returns:
+			Dict: The results of each query in order, and the batch timing in milliseconds.
+		"""
+
+		rerank = rerank if rerank is not None else utils.rerank_params["enabled"]
+		fetch_k = max(k, fetch_k or utils.rerank_params["fetch_k"]) if rerank else k
+		workers = workers or utils.indexing_params["workers"]
+		filter = self.build_filter(retailer, brand, category)
+		hybrid = self.hybrid(filter)
+		top_k = max(fetch_k, utils.hybrid_params["fetch_k"]) if hybrid else fetch_k
+
+		start_time = time.perf_counter()
+		exact = [self.lexical.exact_match(q, top_k=k) for q in queries] if hybrid else [None] * len(queries)
+		pending = [i for i, hit in enumerate(exact) if hit is None]
+		xqs = self.embed_many([queries[i] for i in pending]) if pending else []
+		embed_time = time.perf_counter()
+
+		if not xqs:
+			found = []
+		elif hasattr(self.index, "query_many"):
+			found = self.index.query_many(xqs, top_k=top_k, include_metadata=True, filter=filter)
+		else:
+			with ThreadPoolExecutor(max_workers=workers) as pool:
+				found = list(pool.map(lambda xq: self.index.query(vector=xq, top_k=top_k, include_metadata=True, filter=filter), xqs))
+
+		if hybrid:
+			found = [{"matches": self.fuse(queries[i], xc["matches"], fetch_k), "namespace": ""} for i, xc in zip(pending, found)]
+		query_time = time.perf_counter()
+
+		if rerank:
+			found = [self.rerank(queries[i], xc["matches"], k) for i, xc in zip(pending, found)]
+		end_time = time.perf_counter()
+
+		results = exact
+		for i, xc in zip(pending, found):
+			results[i] = xc
 
-	def execute_query(self, q: str, k: int = 10):
-		xq = utils.embedding_model.encode(q).tolist()
-		xc = self.index.query(vector=xq, top_k=k, include_metadata=True)
+		timing = {"queries": len(queries),
+				  "embed_ms": (embed_time - start_time) * 1000,
+				  "query_ms": (query_time - embed_time) * 1000,
+				  "rerank_ms": (end_time - query_time) * 1000,
+				  "total_ms": (end_time - start_time) * 1000}
 
-		return xc
+		return {"results": results, "timing": timing}
 
 def main():
 	test_queries = ["offers related to pepsi"]
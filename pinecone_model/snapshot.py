@@ -0,0 +1,125 @@
+# Read-only columnar offer snapshot stored as memory-mapped NumPy arrays
+
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from . import versions
+from .categories import parse_categories
+
+snapshot_path = os.environ.get('OFFER_SNAPSHOT_DIR') or os.path.join(os.path.dirname(__file__), '..', 'data', 'offer_snapshot')
+
+_files = ["ids", "offer_bytes", "offer_offsets", "category_names", "category_codes", "category_offsets"]
+
+
+def write_snapshot(processed: pd.DataFrame, path: str = snapshot_path) -> int:
+	"""
+	Writes the processed offers as columns sorted by ID: the IDs as fixed-width
+	bytes, the offer texts as one UTF-8 buffer with offsets, and the categories
+	as a list column of codes into a table of category names.
+
+	The columns are written to a new version directory and published together
+	by swapping the `current` symlink, so readers never mix two snapshots.
+
+	Args:
+		processed (pd.DataFrame): The processed offers with UNIQUE_ID.
+		path (str): The directory holding the snapshot versions.
+
+	Returns:
+		int: The number of offers written.
+	"""
+
+	frame = processed.dropna(subset=["UNIQUE_ID"]).drop_duplicates(subset="UNIQUE_ID", keep="first")
+	frame = frame.sort_values("UNIQUE_ID", kind="stable")
+
+	offers = [str(o).encode("utf-8") for o in frame["OFFER"]]
+	categories = [tuple(sorted(c)) if isinstance(c, (set, frozenset, tuple, list))
+				  else parse_categories(c if isinstance(c, str) else "") for c in frame["CATEGORY"]]
+	names = sorted({c for cats in categories for c in cats})
+	codes = {name: i for i, name in enumerate(names)}
+
+	arrays = {"ids": np.array([str(id).encode("utf-8") for id in frame["UNIQUE_ID"]], dtype=bytes),
+			  "offer_bytes": np.frombuffer(b"".join(offers), dtype=np.uint8),
+			  "offer_offsets": np.concatenate([[0], np.cumsum([len(o) for o in offers])]).astype(np.int64),
+			  "category_names": np.array(names, dtype=str),
+			  "category_codes": np.array([codes[c] for cats in categories for c in cats], dtype=np.int32),
+			  "category_offsets": np.concatenate([[0], np.cumsum([len(cats) for cats in categories])]).astype(np.int64)}
+
+	def write(directory):
+		for name, array in arrays.items():
+			np.save(os.path.join(directory, f"{name}.npy"), array)
+
+	versions.publish(path, write)
+
+	return len(frame)
+
+
+def snapshot_exists(path: str = snapshot_path) -> bool:
+	return versions.current(path) is not None
+
+
+class OfferSnapshot():
+	"""
+	An ID-keyed, read-only view of the offer snapshot. Every column is opened
+	with `mmap_mode='r'`, so opening costs the same at any catalog size and
+	processes serving the same snapshot share its pages through the OS cache.
+	IDs are found by binary search over the sorted ID column.
+
+	It has the lookup interface of retrieval.OfferStore.
+	"""
+
+	def __init__(self, path: str = snapshot_path) -> None:
+		"""
+		Args:
+			path (str): The directory holding the snapshot versions.
+		"""
+
+		# resolved once, so every column comes from the same version
+		self.path = versions.current(path)
+		if self.path is None:
+			raise FileNotFoundError(f"No offer snapshot in {path}")
+		self.columns = {name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r") for name in _files}
+		# the category name table is small and decoded once
+		self.category_names = [sys.intern(str(name)) for name in self.columns["category_names"]]
+
+	def __len__(self) -> int:
+		return len(self.columns["ids"])
+
+	def _row(self, i: int) -> Dict:
+		offer_offsets, category_offsets = self.columns["offer_offsets"], self.columns["category_offsets"]
+		offer = bytes(self.columns["offer_bytes"][offer_offsets[i]:offer_offsets[i + 1]]).decode("utf-8")
+		codes = self.columns["category_codes"][category_offsets[i]:category_offsets[i + 1]]
+		return {"offers": offer, "categories": tuple(self.category_names[c] for c in codes)}
+
+	def lookup(self, ids: List[str]) -> pd.DataFrame:
+		"""
+		Looks up offers by ID, skipping unknown IDs.
+
+		Args:
+			ids (List[str]): The offer IDs in result order.
+
+		Returns:
+			pd.DataFrame: The IDs, offers and categories in the order given.
+		"""
+
+		stored = self.columns["ids"]
+		rows = []
+		if len(stored) and len(ids):
+			keys = np.array([str(id).encode("utf-8") for id in ids], dtype=bytes)
+			positions = np.minimum(np.searchsorted(stored, keys), len(stored) - 1)
+			for id, key, i in zip(ids, keys, positions):
+				if stored[i] == key:
+					rows.append({"ids": id, **self._row(int(i))})
+
+		return pd.DataFrame(rows, columns=["ids", "offers", "categories"])
+
+	def bytes_per_offer(self) -> float:
+		"""
+		Returns:
+			float: The average snapshot size per offer, mapped and shared rather than private.
+		"""
+
+		return sum(column.nbytes for column in self.columns.values()) / max(len(self), 1)
@@ -1,8 +1,7 @@
 import numpy as np
 import random 
 import os
-from sentence_transformers import SentenceTransformer
-import torch
+import threading
 
 api_key = os.environ.get('PINECONE_API_KEY')
 
@@ -13,5 +12,154 @@ params = {"sim_mets": ["l2", "cosine", "dot_product"],
 cloud = os.environ.get('PINECONE_CLOUD') or 'aws'
 region = os.environ.get('PINECONE_REGION') or 'us-east-1'
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2', device=device)
\ No newline at end of file
+# "pinecone" for the managed index or "local" for the in-process index in local_index.py
+backend = os.environ.get('VECTOR_BACKEND') or 'pinecone'
+
+local_params = {"root": os.environ.get('LOCAL_INDEX_DIR') or os.path.join(os.path.dirname(__file__), '..', 'data', 'index'),
+     "mode": os.environ.get('LOCAL_INDEX_MODE') or 'flat',
+     "nlist": int(os.environ.get('LOCAL_INDEX_NLIST') or 64),
+     "nprobe": int(os.environ.get('LOCAL_INDEX_NPROBE') or 8),
+     # "none", "int8" or "binary" codes scanned first, then the top rescore * top_k rescored in float32
+     "quantization": os.environ.get('LOCAL_INDEX_QUANTIZATION') or 'none',
+     "rescore": int(os.environ.get('LOCAL_INDEX_RESCORE') or 4)}
+
+indexing_params = {"batch_size": int(os.environ.get('INDEX_BATCH_SIZE') or 64),
+     "chunk_size": int(os.environ.get('INDEX_CHUNK_SIZE') or 256),
+     "workers": int(os.environ.get('INDEX_WORKERS') or 4),
+     # collapse offers whose estimated text Jaccard similarity reaches dedup_threshold
+     "dedup": os.environ.get('INDEX_DEDUP', '').lower() in ('1', 'true', 'yes'),
+     "dedup_threshold": float(os.environ.get('INDEX_DEDUP_THRESHOLD') or 0.8),
+     # streaming indexer: chunks held between stages, and the resume checkpoint written every checkpoint_every chunks
+     "queue_size": int(os.environ.get('INDEX_QUEUE_SIZE') or 4),
+     "checkpoint_path": os.environ.get('INDEX_CHECKPOINT_PATH') or os.path.join(os.path.dirname(__file__), '..', 'data', 'index_checkpoint.json'),
+     "checkpoint_every": int(os.environ.get('INDEX_CHECKPOINT_EVERY') or 8)}
+
+# QUERY_CACHE_PATH persists query embeddings across restarts, e.g. data/query_cache.pkl
+cache_params = {"size": int(os.environ.get('QUERY_CACHE_SIZE') or 1024),
+     "path": os.environ.get('QUERY_CACHE_PATH')}
+
+# Opt-in second stage: over-fetch fetch_k candidates and rerank them with the cross-encoder
+rerank_params = {"enabled": os.environ.get('RERANK', '').lower() in ('1', 'true', 'yes'),
+     "fetch_k": int(os.environ.get('RERANK_FETCH_K') or 30),
+     "budget_ms": float(os.environ.get('RERANK_BUDGET_MS') or 250),
+     "batch_size": int(os.environ.get('RERANK_BATCH_SIZE') or 16),
+     "cache_size": int(os.environ.get('RERANK_CACHE_SIZE') or 4096)}
+
+# Opt-in BM25 + vector fusion; fetch_k candidates come from each retriever before fusing
+hybrid_params = {"enabled": os.environ.get('HYBRID', '').lower() in ('1', 'true', 'yes'),
+     "fetch_k": int(os.environ.get('HYBRID_FETCH_K') or 50),
+     "rrf_k": int(os.environ.get('HYBRID_RRF_K') or 60)}
+
+model_names = {"embedding": 'sentence-transformers/all-MiniLM-L6-v2',
+     "reranker": 'BAAI/bge-reranker-large'}
+
+# Query encoder precision: "fp32", "int8" (dynamically quantized linear layers, CPU only)
+# or "onnx" (ONNX Runtime, needs optimum[onnxruntime])
+encoder = os.environ.get('EMBEDDING_ENCODER') or 'fp32'
+
+# Models are only loaded on first use so importing this package stays cheap
+_models = {}
+_model_lock = threading.Lock()
+
+
+def _load_model(name, factory):
+    """
+    Returns the model stored under `name`, building it with `factory` the first
+    time it is requested. The lock makes sure concurrent callers share one instance.
+    """
+
+    model = _models.get(name)
+    if model is None:
+        with _model_lock:
+            model = _models.get(name)
+            if model is None:
+                model = factory()
+                _models[name] = model
+
+    return model
+
+
+def get_device():
+    """
+    Returns:
+        str: 'cuda' if a GPU is available, otherwise 'cpu'.
+    """
+
+    def factory():
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    return _load_model("device", factory)
+
+
+def build_embedding_model(kind: str = "fp32"):
+    """
+    Builds a MiniLM SentenceTransformer with the given precision.
+
+    Args:
+        kind (str): "fp32", "int8" or "onnx".
+
+    Returns:
+        The SentenceTransformer.
+    """
+
+    from sentence_transformers import SentenceTransformer
+
+    if kind == "onnx":
+        return SentenceTransformer(model_names["embedding"], device="cpu", backend="onnx")
+
+    if kind == "int8":
+        import torch
+        model = SentenceTransformer(model_names["embedding"], device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if kind != "fp32":
+        raise ValueError(f"Unknown encoder: {kind}")
+
+    return SentenceTransformer(model_names["embedding"], device=get_device())
+
+
+def get_embedding_model():
+    """
+    Returns:
+        The shared MiniLM SentenceTransformer, in the precision set by `encoder`.
+    """
+
+    return _load_model("embedding", lambda: build_embedding_model(encoder))
+
+
+def get_reranker():
+    """
+    Returns:
+        The shared bge cross-encoder.
+    """
+
+    def factory():
+        from FlagEmbedding import FlagReranker
+        # Setting use_fp16 to True speeds up computation with a slight performance degradation
+        return FlagReranker(model_names["reranker"], use_fp16=True)
+
+    return _load_model("reranker", factory)
+
+
+def warmup(rerank: bool = False) -> None:
+    """
+    Loads the models and runs a dummy forward pass so the first real query does
+    not pay for initialization.
+
+    Args:
+        rerank (bool): Whether to warm up the reranker as well.
+    """
+
+    get_embedding_model().encode("warmup")
+    if rerank:
+        get_reranker().compute_score(["warmup", "warmup"])
+
+
+def __getattr__(name):
+    # keeps `utils.embedding_model` and `utils.device` working without eager loading
+    if name == "embedding_model":
+        return get_embedding_model()
+    if name == "device":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,61 @@
+# Directories published as a whole by swapping a symlink to their latest version
+
+import os
+import re
+import shutil
+from typing import Callable, Optional
+
+CURRENT = "current"
+
+
+def current(path: str) -> Optional[str]:
+	"""
+	Args:
+		path (str): The directory holding the versions.
+
+	Returns:
+		str: The directory of the published version, or None before the first publish.
+	"""
+
+	link = os.path.join(path, CURRENT)
+	return os.path.realpath(link) if os.path.islink(link) else None
+
+
+def publish(path: str, write: Callable[[str], None]) -> str:
+	"""
+	Writes a new version into its own directory and publishes it by replacing
+	the `current` symlink with an atomic rename. Readers resolve the link once,
+	so they see either the old or the new version, never a mix of both.
+
+	The previous version is kept for readers that resolved the link just before
+	the swap; older ones are removed.
+
+	Args:
+		path (str): The directory holding the versions.
+		write (Callable[[str], None]): Writes the files of the new version into the given directory.
+
+	Returns:
+		str: The directory of the new version.
+	"""
+
+	os.makedirs(path, exist_ok=True)
+	numbers = [int(name[1:]) for name in os.listdir(path) if re.fullmatch(r"v\d+", name)]
+	name = f"v{max(numbers, default=0) + 1}"
+	version = os.path.join(path, name)
+	os.makedirs(version)
+	write(version)
+
+	previous = current(path)
+	tmp = os.path.join(path, f"{CURRENT}.tmp")
+	if os.path.lexists(tmp):
+		os.remove(tmp)
+	# a relative link keeps working if the whole directory is moved
+	os.symlink(name, tmp)
+	os.replace(tmp, os.path.join(path, CURRENT))
+
+	for old in numbers:
+		directory = os.path.join(path, f"v{old}")
+		if directory != previous:
+			shutil.rmtree(directory, ignore_errors=True)
+
+	return version
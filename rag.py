@@ -0,0 +1,182 @@
+# Retrieval-augmented generation over the categories of retrieved offers
+
+import os
+import threading
+from typing import Iterable, Iterator, List, Tuple
+from langchain.prompts import PromptTemplate
+from pinecone_model.cache import LRUCache
+
+prompt = """
+	Given these categories of items:
+
+	{CAT_STR}
+
+	Could you provide recommendations of items to purchase and where to find them?
+	Provide your response in the following format:
+
+	Category 1 name: \n
+	Recommendation: \n
+	Where to find: \n
+
+	Category 2: \n
+	Recommendation: \n
+	Where to find: \n
+	...
+	Use a bulleted list
+	"""
+
+template = PromptTemplate(template=prompt, input_variables=["CAT_STR"])
+
+# "groq" for LLaMA through the Groq API or "stub" for the offline StubLLM
+llm_backend = os.environ.get('LLM_BACKEND') or 'groq'
+
+_llm = None
+_llm_lock = threading.Lock()
+
+# Responses keyed on the canonical category set; RAG_CACHE_PATH adds an on-disk tier,
+# saved every RAG_CACHE_SAVE_EVERY new responses and at exit
+rag_cache = LRUCache(maxsize=int(os.environ.get('RAG_CACHE_SIZE') or 256),
+					 path=os.environ.get('RAG_CACHE_PATH'),
+					 ttl=float(os.environ.get('RAG_CACHE_TTL') or 24 * 60 * 60),
+					 save_every=int(os.environ.get('RAG_CACHE_SAVE_EVERY') or 16))
+
+
+class StubChunk():
+	def __init__(self, content: str) -> None:
+		self.content = content
+
+
+class StubLLM():
+	"""
+	A deterministic offline stand-in for the chat model. It streams a canned
+	recommendation for every category in the prompt, word by word.
+	"""
+
+	def respond(self, prompt: str) -> str:
+		"""
+		Builds the canned response for the categories listed in the prompt.
+		"""
+
+		lines = [l.strip() for l in prompt.strip().splitlines() if l.strip()]
+		categories = lines[1].split(", ") if len(lines) > 1 else []
+
+		return "\n".join(f"- **{c}**\n  - Recommendation: popular {c.lower()} items\n  - Where to find: most grocery retailers"
+						 for c in categories if c)
+
+	def stream(self, prompt: str) -> Iterator[StubChunk]:
+		for word in self.respond(prompt).split(" "):
+			yield StubChunk(word + " ")
+
+	def invoke(self, prompt: str) -> StubChunk:
+		return StubChunk(self.respond(prompt))
+
+
+def get_llm():
+	"""
+	Returns the shared chat model, created on first use.
+
+	Returns:
+		The configured chat model, or a StubLLM when LLM_BACKEND=stub.
+	"""
+
+	global _llm
+
+	if _llm is None:
+		with _llm_lock:
+			if _llm is None:
+				if llm_backend == "stub":
+					_llm = StubLLM()
+				else:
+					from langchain_groq import ChatGroq
+					_llm = ChatGroq(model="llama3-70b-8192", api_key=os.environ.get('LLAMA_KEY'))
+
+	return _llm
+
+
+def collect_categories(categories: Iterable[Iterable[str]]) -> List[str]:
+	"""
+	Flattens the category tuples of the retrieved offers.
+
+	Args:
+		categories (Iterable[Iterable[str]]): The parsed categories of each offer.
+
+	Returns:
+		List[str]: The distinct categories.
+	"""
+
+	parsed_cats = set()
+	for full_cat in categories:
+		parsed_cats.update(full_cat)
+
+	return list(parsed_cats)
+
+
+def canonical_categories(categories: Iterable[str]) -> Tuple[str, ...]:
+	"""
+	Normalizes a category set into a stable, sorted tuple so the same set always
+	produces the same prompt and cache key.
+
+	Args:
+		categories (Iterable[str]): The categories.
+
+	Returns:
+		Tuple[str, ...]: The distinct, whitespace-normalized categories in sorted order.
+	"""
+
+	return tuple(sorted({" ".join(c.split()) for c in categories if c and c.strip()}))
+
+
+def stream_rag(categories: List[str]) -> Iterator[str]:
+	"""
+	Streams the recommendations for a set of categories as the model generates them.
+	A response already generated for the same category set is returned from
+	`rag_cache` without calling the model.
+
+	Args:
+		categories (List[str]): The categories to recommend items for.
+
+	Yields:
+		str: The generated text, chunk by chunk.
+	"""
+
+	key = canonical_categories(categories)
+	cached = rag_cache.get(key)
+	if cached is not None:
+		yield cached
+		return
+
+	yield from generate(key)
+
+
+def generate(key: Tuple[str, ...]) -> Iterator[str]:
+	"""
+	Streams a fresh response from the model and caches it once complete.
+
+	Args:
+		key (Tuple[str, ...]): The canonical category set, from `canonical_categories`.
+
+	Yields:
+		str: The generated text, chunk by chunk.
+	"""
+
+	chunks = []
+	for chunk in get_llm().stream(template.format(CAT_STR=", ".join(key))):
+		chunks.append(chunk.content)
+		yield chunk.content
+
+	# only completed responses are cached
+	rag_cache.put(key, "".join(chunks))
+
+
+def perform_rag(categories: List[str]) -> str:
+	"""
+	Performs retrieval-augmented generation (RAG) using the extracted categories.
+
+	Args:
+		categories (List[str]): The categories to recommend items for.
+
+	Returns:
+		str: The generated recommendations based on categories.
+	"""
+
+	return "".join(stream_rag(categories))
@@ -0,0 +1,373 @@
+# Retrieval pipeline shared by the Streamlit app and the HTTP search service
+
+import codecs
+import json
+import os
+import time
+import urllib.request
+from typing import Dict, Iterator, List, Tuple
+import pandas as pd
+import pandas.io.sql as psql
+import psycopg2
+from db import queries
+from db import pool as db_pool
+import rag
+import tracing
+from pinecone_model.categories import get_tree, parse_categories
+from pinecone_model.snapshot import OfferSnapshot, snapshot_exists, snapshot_path
+
+db_params = {"host": os.environ.get('DB_HOST') or "localhost",
+	"name": os.environ.get('DB_NAME') or "couponsdb",
+	"user": os.environ.get('DB_USER') or "calvinyu",
+	"password": os.environ.get('DB_PASSWORD') or "password"}
+
+offers_path = os.environ.get('OFFERS_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'processed_offers.csv')
+
+
+def parse_pine(results: Dict) -> List[str]:
+	"""
+	Parses Pinecone search results to extract IDs and metadata.
+
+	Args:
+		results (Dict): The results returned from a Pinecone query.
+
+	Returns:
+		List[str]: A list of extracted IDs from the results.
+	"""
+
+	table_data = []
+	ids = []
+
+	for i, result in enumerate(results['matches'], start=1):
+		ids.append(result['id'])
+		result_data = {
+			"ID": result['id'],
+			"metadata": result['metadata']["Categories"],
+			"score": result['score']
+		}
+		table_data.append(result_data)
+
+	return ids
+
+
+class OfferStore():
+	"""
+	An ID-keyed store of offers and their parsed categories, built once per process.
+
+	Attributes:
+		frame (pd.DataFrame): Offers and category tuples indexed by offer ID.
+	"""
+
+	def __init__(self, data: pd.DataFrame) -> None:
+		"""
+		Builds the store from the processed offers data.
+
+		Args:
+			data (pd.DataFrame): The processed offers data.
+		"""
+
+		frame = pd.DataFrame({"offers": data["OFFER"].values,
+							  "categories": [parse_categories(c) for c in data["CATEGORY"]]},
+							 index=pd.Index(data["UNIQUE_ID"].values, name="ids"))
+		self.frame = frame[~frame.index.duplicated(keep="first")]
+
+	def __len__(self) -> int:
+		return len(self.frame)
+
+	def lookup(self, ids: List[str]) -> pd.DataFrame:
+		"""
+		Looks up offers by ID with a single indexed lookup, skipping unknown IDs.
+
+		Args:
+			ids (List[str]): The offer IDs in result order.
+
+		Returns:
+			pd.DataFrame: The IDs, offers and categories in the order given.
+		"""
+
+		rows = self.frame.reindex(ids).dropna(subset=["offers"])
+		return rows.reset_index()
+
+	def bytes_per_offer(self) -> float:
+		"""
+		Returns:
+			float: The average memory held per offer, including the strings.
+		"""
+
+		return self.frame.memory_usage(deep=True).sum() / max(len(self.frame), 1)
+
+
+def load_offer_store(path: str = offers_path, snapshot: str = snapshot_path):
+	"""
+	Opens the memory-mapped offer snapshot written by preprocessing, or loads
+	the processed offers CSV into an OfferStore when there is no snapshot.
+
+	Args:
+		path (str): The processed offers CSV.
+		snapshot (str): The snapshot directory.
+
+	Returns:
+		OfferSnapshot or OfferStore: The processed offers keyed by ID.
+	"""
+
+	data = OfferSnapshot(snapshot) if snapshot_exists(snapshot) else OfferStore(pd.read_csv(path))
+	print(f"Loaded {len(data)} offers ({data.bytes_per_offer():.0f} bytes/offer)")
+	return data
+
+
+def load_lexical_index(conn: psycopg2.extensions.connection, path: str = offers_path):
+	"""
+	Builds the BM25 index over the processed offers and the brand and retailer
+	names stored in `coupons.offer`.
+
+	Args:
+		conn (psycopg2.extensions.connection): A pooled database connection.
+		path (str): The processed offers CSV.
+
+	Returns:
+		BM25Index: The lexical index.
+	"""
+
+	from pinecone_model import dedup, indexer, lexical, utils
+
+	offers = psql.read_sql(queries.offer_brands, conn)
+	parsed_data, members = indexer.parse_data(pd.read_csv(path), offers), {}
+	if utils.indexing_params["dedup"]:
+		# match the vector index, which only holds one offer per near-duplicate cluster
+		parsed_data, members = dedup.collapse(parsed_data, utils.indexing_params["dedup_threshold"])
+	index = lexical.build_index(parsed_data, members)
+	print(f"Indexed {len(index)} offers for lexical search")
+	return index
+
+
+def parse_members(results: Dict) -> Dict[str, Tuple[str, ...]]:
+	"""
+	Extracts the collapsed near-duplicates of each matched offer.
+
+	Args:
+		results (Dict): The results returned from a Pinecone query.
+
+	Returns:
+		Dict[str, Tuple[str, ...]]: The member IDs of every match.
+	"""
+
+	return {m["id"]: tuple(m.get("metadata", {}).get("Members", ())) for m in results["matches"]}
+
+
+def expand_members(df: pd.DataFrame) -> List[str]:
+	"""
+	Lists each result's ID followed by the IDs of its collapsed near-duplicates,
+	so enrichment returns every variant of a distinct result.
+
+	Args:
+		df (pd.DataFrame): The search results, with an optional "members" column.
+
+	Returns:
+		List[str]: The offer IDs to enrich, in result order.
+	"""
+
+	members = df["members"] if "members" in df else [()] * len(df)
+	return [id for rep, m in zip(df["ids"], members) for id in (rep, *m)]
+
+
+def convert_to_df(ids: List[str], data) -> pd.DataFrame:
+	"""
+	Converts Pinecone IDs to a DataFrame with corresponding offers and categories.
+
+	Args:
+		ids (List[str]): The list of IDs to convert.
+		data (OfferStore or OfferSnapshot): The offers to match IDs with offers and categories.
+
+	Returns:
+		pd.DataFrame: A DataFrame containing IDs, offers, and categories.
+	"""
+
+	return data.lookup(ids)
+
+
+enriched_columns = ["offer_id", "offer", "retailer", "brand", "categories", "brand_categories", "parent_categories"]
+
+
+def get_enriched_offers(conn: psycopg2.extensions.connection, ids: List[str]) -> pd.DataFrame:
+	"""
+	Fetches the fully enriched rows of a list of offers from the `offer_enriched`
+	materialized view with the prepared `enriched_lookup` statement.
+
+	Args:
+		conn (psycopg2.extensions.connection): A pooled database connection.
+		ids (List[str]): The offer IDs in result order.
+
+	Returns:
+		pd.DataFrame: The offer, retailer, brand and category columns of each known
+		offer, in the order given.
+	"""
+
+	if not ids:
+		return pd.DataFrame(columns=enriched_columns)
+
+	return psql.read_sql(queries.execute_enriched_lookup, conn, params=(list(ids),))
+
+
+def get_offers_in_category(conn: psycopg2.extensions.connection, category: str) -> pd.DataFrame:
+	"""
+	Fetches every offer in a category or any category below it, with one query
+	over the category closure table and the GIN-indexed category arrays.
+
+	Args:
+		conn (psycopg2.extensions.connection): A pooled database connection.
+		category (str): The category name.
+
+	Returns:
+		pd.DataFrame: A DataFrame containing the matching offer rows.
+	"""
+
+	return psql.read_sql(queries.offers_under_category, conn, params=(category,))
+
+
+class SearchPipeline():
+	"""
+	Holds the searcher, offer store and database settings of one process and runs
+	the search, enrichment and RAG stages against them.
+	"""
+
+	def __init__(self, index_name: str = "beta-index", data=None, db: Dict = None) -> None:
+		"""
+		Args:
+			index_name (str): The vector index to search.
+			data (OfferSnapshot or OfferStore): The offers, loaded by `load_offer_store` by default.
+			db (Dict): The database connection parameters, `db_params` by default.
+		"""
+
+		from pinecone_model import searcher as pine_searcher
+		from pinecone_model import utils
+
+		self.data = data or load_offer_store()
+		self.db = db or db_params
+
+		lexical = None
+		if utils.hybrid_params["enabled"]:
+			with db_pool.connection(**self.db) as conn:
+				lexical = load_lexical_index(conn)
+		self.searcher = pine_searcher.Searcher(index_name, lexical=lexical)
+
+	def search(self, query: str, k: int, **filters) -> Tuple[float, pd.DataFrame]:
+		"""
+		Runs the vector search and looks up the matched offers.
+
+		Args:
+			query (str): The search query.
+			k (int): The number of results to return.
+			**filters: Optional retailer, brand and category filters.
+
+		Returns:
+			Tuple[float, pd.DataFrame]: The search time and the IDs, offers, categories
+			and collapsed near-duplicate IDs.
+		"""
+
+		with tracing.request("search"):
+			start_time = time.time()
+			res = self.searcher.execute_query(query, k=k, **filters)
+			execution_time = time.time() - start_time
+
+			with tracing.stage("offer_lookup"):
+				df = convert_to_df(parse_pine(res), self.data)
+				members = parse_members(res)
+				df["members"] = [members.get(id, ()) for id in df["ids"]]
+				return execution_time, df
+
+	def enrich(self, ids: List[str]) -> pd.DataFrame:
+		"""
+		Fetches the enriched rows of the given offers, in the order given.
+		"""
+
+		with tracing.request("enrich"), tracing.stage("sql_enrichment"):
+			with db_pool.connection(**self.db) as conn:
+				return get_enriched_offers(conn, ids)
+
+	def offers_in_category(self, category: str) -> pd.DataFrame:
+		"""
+		Fetches every offer in a category or any category below it. The category
+		is matched case-insensitively.
+		"""
+
+		with tracing.request("category"), tracing.stage("sql_category"):
+			with db_pool.connection(**self.db) as conn:
+				return get_offers_in_category(conn, get_tree().resolve(category))
+
+	def stream_rag(self, categories: List[str]) -> Iterator[str]:
+		"""
+		Streams recommendations for the given categories, recording the time to
+		the first chunk and to the full response of the model. Responses served
+		from the RAG cache are recorded separately, so they do not skew the model
+		latencies.
+		"""
+
+		start_time = time.perf_counter()
+		key = rag.canonical_categories(categories)
+		cached = rag.rag_cache.get(key)
+		if cached is not None:
+			tracing.tracer.observe("rag_cache_hit", (time.perf_counter() - start_time) * 1000)
+			yield cached
+			return
+
+		first = True
+		for chunk in rag.generate(key):
+			if first:
+				tracing.tracer.observe("llm_first_token", (time.perf_counter() - start_time) * 1000)
+				first = False
+			yield chunk
+
+		tracing.tracer.observe("llm", (time.perf_counter() - start_time) * 1000)
+
+
+class SearchClient():
+	"""
+	Calls a running search service (service.py) with the same interface as
+	SearchPipeline, so callers do not need to know where retrieval runs.
+	"""
+
+	def __init__(self, url: str, timeout: float = 30.0) -> None:
+		"""
+		Args:
+			url (str): The base URL of the service.
+			timeout (float): The request timeout in seconds.
+		"""
+
+		self.url = url.rstrip("/")
+		self.timeout = timeout
+
+	def _post(self, path: str, payload: Dict):
+		request = urllib.request.Request(self.url + path, data=json.dumps(payload).encode("utf-8"),
+										 headers={"Content-Type": "application/json"})
+		return urllib.request.urlopen(request, timeout=self.timeout)
+
+	def search(self, query: str, k: int, **filters) -> Tuple[float, pd.DataFrame]:
+		with self._post("/search", {"query": query, "k": k, **filters}) as response:
+			body = json.load(response)
+
+		df = pd.DataFrame(body["results"], columns=["ids", "offers", "categories", "members"])
+		df["categories"] = [tuple(c) for c in df["categories"]]
+		df["members"] = [tuple(m) if isinstance(m, list) else () for m in df["members"]]
+		return body["execution_time"], df
+
+	def enrich(self, ids: List[str]) -> pd.DataFrame:
+		with self._post("/enrich", {"ids": list(ids)}) as response:
+			body = json.load(response)
+
+		return pd.DataFrame(body["rows"], columns=enriched_columns)
+
+	def offers_in_category(self, category: str) -> pd.DataFrame:
+		with self._post("/category", {"category": category}) as response:
+			body = json.load(response)
+
+		return pd.DataFrame(body["rows"])
+
+	def stream_rag(self, categories: List[str]) -> Iterator[str]:
+		decoder = codecs.getincrementaldecoder("utf-8")()
+		with self._post("/rag", {"categories": list(categories)}) as response:
+			while True:
+				chunk = response.read1(1024)
+				if not chunk:
+					break
+				yield decoder.decode(chunk)
+		yield decoder.decode(b"", final=True)
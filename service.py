@@ -0,0 +1,116 @@
+# Headless HTTP search service; run with `python service.py --workers 4`
+
+import argparse
+import glob
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+import retrieval
+import tracing
+
+# One pipeline per worker process, created when the worker starts
+pipeline = None
+
+
+class SearchRequest(BaseModel):
+	query: str
+	k: int = 5
+	retailer: Optional[str] = None
+	brand: Optional[str] = None
+	category: Optional[str] = None
+
+
+class EnrichRequest(BaseModel):
+	ids: List[str]
+
+
+class CategoryRequest(BaseModel):
+	category: str
+
+
+class RagRequest(BaseModel):
+	categories: List[str]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	"""
+	Loads the models, offer store and connection pool once per worker.
+	"""
+
+	global pipeline
+	from pinecone_model import utils
+
+	pipeline = retrieval.SearchPipeline(os.environ.get('INDEX_NAME') or "beta-index")
+	utils.warmup(rerank=utils.rerank_params["enabled"])
+	yield
+
+
+app = FastAPI(title="Coupon search", lifespan=lifespan)
+
+
+@app.get("/health")
+def health():
+	return {"status": "ok", "offers": len(pipeline.data)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+	# the histograms of every worker, summed through TRACE_METRICS_DIR
+	return tracing.tracer.prometheus()
+
+
+@app.post("/search")
+def search(request: SearchRequest):
+	execution_time, df = pipeline.search(request.query, request.k, retailer=request.retailer,
+										 brand=request.brand, category=request.category)
+	results = [{"ids": id, "offers": offer, "categories": list(categories), "members": list(members)}
+			   for id, offer, categories, members in zip(df["ids"], df["offers"], df["categories"], df["members"])]
+
+	return {"execution_time": execution_time, "results": results}
+
+
+@app.post("/enrich")
+def enrich(request: EnrichRequest):
+	rows = pipeline.enrich(request.ids)
+	return {"rows": rows.to_dict(orient="records")}
+
+
+@app.post("/category")
+def category(request: CategoryRequest):
+	rows = pipeline.offers_in_category(request.category)
+	return {"rows": rows.to_dict(orient="records")}
+
+
+@app.post("/rag")
+def rag(request: RagRequest):
+	return StreamingResponse(pipeline.stream_rag(request.categories), media_type="text/plain; charset=utf-8")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Runs the coupon search service.")
+	parser.add_argument("--host", default="0.0.0.0")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--workers", type=int, default=2)
+	args = parser.parse_args()
+
+	# workers share their histograms through a directory, so /metrics totals every worker
+	# whichever one answers the scrape; the counts of a previous run are dropped
+	metrics_dir = os.environ.get('TRACE_METRICS_DIR')
+	if args.workers > 1 and not metrics_dir:
+		metrics_dir = os.environ['TRACE_METRICS_DIR'] = tempfile.mkdtemp(prefix="coupons-metrics-")
+	if metrics_dir:
+		os.makedirs(metrics_dir, exist_ok=True)
+		for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+			os.remove(path)
+
+	import uvicorn
+	uvicorn.run("service:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,276 @@
+# Per-stage latency tracing for the query path, exported as Prometheus text or JSON lines
+
+import atexit
+import contextvars
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+trace_params = {"jsonl_path": os.environ.get('TRACE_JSONL_PATH'),
+	"profile_rate": float(os.environ.get('TRACE_PROFILE_RATE') or 0),
+	"slow_ms": float(os.environ.get('TRACE_SLOW_MS') or 1000),
+	"profile_dir": os.environ.get('TRACE_PROFILE_DIR') or "profiles",
+	# shared by the worker processes of one service, so any of them can serve the totals of all
+	"metrics_dir": os.environ.get('TRACE_METRICS_DIR'),
+	"metrics_interval": float(os.environ.get('TRACE_METRICS_INTERVAL') or 5)}
+
+# The stage timings of the request running in the current thread or task
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram():
+	"""
+	A cumulative latency histogram in the Prometheus layout.
+
+	Attributes:
+		counts (List[int]): The number of observations at or below each bucket bound.
+		total (float): The sum of all observations in milliseconds.
+		count (int): The number of observations.
+	"""
+
+	def __init__(self, buckets: List[float] = BUCKETS) -> None:
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.total = 0.0
+		self.count = 0
+
+	def observe(self, ms: float) -> None:
+		self.total += ms
+		self.count += 1
+		for i, bound in enumerate(self.buckets):
+			if ms <= bound:
+				self.counts[i] += 1
+
+	def add(self, counts: List[int], total: float, count: int) -> None:
+		"""
+		Adds the observations of another histogram with the same buckets.
+		"""
+
+		self.counts = [a + b for a, b in zip(self.counts, counts)]
+		self.total += total
+		self.count += count
+
+	def quantile(self, q: float) -> float:
+		"""
+		Estimates a quantile as the smallest bucket bound covering it.
+		"""
+
+		target = q * self.count
+		for bound, count in zip(self.buckets, self.counts):
+			if count >= target:
+				return bound
+		return float("inf")
+
+
+class Tracer():
+	"""
+	Records how long each stage of a request takes into per-stage histograms.
+	Requests can also be written as JSON lines, and a sampled fraction is run
+	under cProfile, keeping the profile when the request turns out to be slow.
+
+	With `metrics_dir`, a background thread of every process writes its
+	histograms to its own file there every `metrics_interval` seconds and at
+	exit, and `prometheus` serves the sum over all files, so a scrape reaching
+	any worker of a multi-process server sees every worker.
+	"""
+
+	def __init__(self, jsonl_path: Optional[str] = None, profile_rate: float = 0.0,
+				 slow_ms: float = 1000.0, profile_dir: str = "profiles", metrics_dir: Optional[str] = None,
+				 metrics_interval: float = 5.0) -> None:
+		"""
+		Args:
+			jsonl_path (str): An optional file each finished request is appended to.
+			profile_rate (float): The fraction of requests run under cProfile.
+			slow_ms (float): The request duration above which a profile is kept.
+			profile_dir (str): The directory profiles are written to.
+			metrics_dir (str): An optional directory the histograms of every process are shared through.
+			metrics_interval (float): The seconds between writes to `metrics_dir`.
+		"""
+
+		self.jsonl_path = jsonl_path
+		self.profile_rate = profile_rate
+		self.slow_ms = slow_ms
+		self.profile_dir = profile_dir
+		self.metrics_dir = metrics_dir
+		self.metrics_interval = metrics_interval
+		self.histograms = {}
+		self._lock = threading.Lock()
+		# started by the first observation, so each worker process runs its own
+		self._writer = None
+		self._write_lock = threading.Lock()
+		# only one cProfile profiler may be active at a time
+		self._profile_lock = threading.Lock()
+
+	def observe(self, name: str, ms: float) -> None:
+		"""
+		Records a stage duration, also attaching it to the current request.
+		"""
+
+		with self._lock:
+			if name not in self.histograms:
+				self.histograms[name] = Histogram()
+			self.histograms[name].observe(ms)
+			start_writer = self.metrics_dir and self._writer is None
+			if start_writer:
+				self._writer = threading.Thread(target=self._write_periodically, daemon=True)
+
+		if start_writer:
+			self._writer.start()
+			atexit.register(self._write_metrics)
+
+		trace = _current.get()
+		if trace is not None:
+			trace[name] = trace.get(name, 0.0) + ms
+
+	def _write_periodically(self) -> None:
+		while True:
+			time.sleep(self.metrics_interval)
+			try:
+				self._write_metrics()
+			except OSError as e:
+				print(f"Could not write metrics to {self.metrics_dir}: {e}")
+
+	def _write_metrics(self) -> None:
+		"""
+		Replaces this process's file in `metrics_dir` with its current histograms.
+		"""
+
+		path = os.path.join(self.metrics_dir, f"{os.getpid()}.json")
+		with self._lock:
+			state = {name: {"counts": list(h.counts), "total": h.total, "count": h.count}
+					 for name, h in self.histograms.items()}
+
+		with self._write_lock:
+			os.makedirs(self.metrics_dir, exist_ok=True)
+			with open(f"{path}.tmp", "w") as f:
+				json.dump(state, f)
+			os.replace(f"{path}.tmp", path)
+
+	def _shared_histograms(self) -> Dict[str, Histogram]:
+		"""
+		Returns:
+			Dict[str, Histogram]: The histograms of this process, summed with those
+			of every other process writing to `metrics_dir`.
+		"""
+
+		if not self.metrics_dir:
+			return self.histograms
+
+		self._write_metrics()
+		histograms = {}
+		for file in os.listdir(self.metrics_dir):
+			if not file.endswith(".json"):
+				continue
+			try:
+				with open(os.path.join(self.metrics_dir, file)) as f:
+					state = json.load(f)
+			except (OSError, ValueError):
+				continue
+			for name, h in state.items():
+				histograms.setdefault(name, Histogram()).add(h["counts"], h["total"], h["count"])
+
+		return histograms
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		"""
+		Times the enclosed block as one stage.
+
+		Args:
+			name (str): The stage name, e.g. "embed" or "vector_query".
+		"""
+
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, (time.perf_counter() - start) * 1000)
+
+	@contextmanager
+	def request(self, name: str = "request") -> Iterator[Dict[str, float]]:
+		"""
+		Times a whole request and collects the stages that run inside it.
+
+		Args:
+			name (str): The request type, recorded as its own histogram.
+
+		Yields:
+			Dict[str, float]: The stage timings of this request in milliseconds.
+		"""
+
+		trace = {}
+		token = _current.set(trace)
+		profiler = None
+		if self.profile_rate and random.random() < self.profile_rate and self._profile_lock.acquire(blocking=False):
+			profiler = cProfile.Profile()
+			profiler.enable()
+
+		start = time.perf_counter()
+		try:
+			yield trace
+		finally:
+			total_ms = (time.perf_counter() - start) * 1000
+			_current.reset(token)
+
+			if profiler is not None:
+				profiler.disable()
+				if total_ms > self.slow_ms:
+					os.makedirs(self.profile_dir, exist_ok=True)
+					profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{int(time.time() * 1000)}.prof"))
+				self._profile_lock.release()
+
+			self.observe(name, total_ms)
+			if self.jsonl_path:
+				self._write_jsonl(name, total_ms, trace)
+
+	def _write_jsonl(self, name: str, total_ms: float, trace: Dict[str, float]) -> None:
+		line = json.dumps({"ts": time.time(), "request": name, "total_ms": total_ms, "stages": trace})
+		with self._lock:
+			with open(self.jsonl_path, "a") as f:
+				f.write(line + "\n")
+
+	def prometheus(self) -> str:
+		"""
+		Returns:
+			str: Every stage histogram in the Prometheus text exposition format,
+			summed over the processes sharing `metrics_dir`.
+		"""
+
+		histograms = self._shared_histograms()
+
+		lines = ["# HELP coupons_stage_duration_ms Duration of each query path stage in milliseconds.",
+				 "# TYPE coupons_stage_duration_ms histogram"]
+
+		with self._lock:
+			for name, h in sorted(histograms.items()):
+				for bound, count in zip(h.buckets, h.counts):
+					lines.append(f'coupons_stage_duration_ms_bucket{{stage="{name}",le="{bound}"}} {count}')
+				lines.append(f'coupons_stage_duration_ms_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+				lines.append(f'coupons_stage_duration_ms_sum{{stage="{name}"}} {h.total}')
+				lines.append(f'coupons_stage_duration_ms_count{{stage="{name}"}} {h.count}')
+
+		return "\n".join(lines) + "\n"
+
+	def summary(self) -> Dict[str, Dict[str, float]]:
+		"""
+		Returns:
+			Dict[str, Dict[str, float]]: The count, mean and estimated p50/p99 of each stage.
+		"""
+
+		with self._lock:
+			return {name: {"count": h.count, "mean_ms": h.total / h.count if h.count else 0.0,
+						   "p50_ms": h.quantile(0.5), "p99_ms": h.quantile(0.99)}
+					for name, h in self.histograms.items()}
+
+
+tracer = Tracer(**trace_params)
+stage = tracer.stage
+request = tracer.request